@@ -7,8 +7,15 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
-from .schema import SchemaWrapper, PostLoadSchema  # noqa
+from .schema import (  # noqa
+    SchemaWrapper, PostLoadSchema, InstanceFieldSchema
+)
 from .exceptions import RegistryNotFound  # noqa
+from .render import set_default_render  # noqa
+from .warmup import warm_up, WarmUpReport  # noqa
+from .cache import (  # noqa
+    LRUCache, SchemaCache, InstanceCache, schema_cache
+)
 from .fields import (  # noqa
     Nested, File, Text, JsonCollection, PhoneNumber, Country, InstanceField
 )
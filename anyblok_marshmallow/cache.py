@@ -0,0 +1,255 @@
+# This file is a part of the AnyBlok / Marshmallow api project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from collections import OrderedDict, namedtuple
+from threading import RLock
+from weakref import ref
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache:
+    """Bounded mapping which forget the least recently used entries
+
+    ::
+
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.get('a')  # 1
+        cache.cache_info()  # CacheInfo(hits=1, misses=0, maxsize=2, currsize=1)
+
+    :param maxsize: max number of entries kept, None for unbounded
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.lock = RLock()
+        self.data = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        """Return the value of the key and mark it as recently used"""
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Save the value and forget the oldest entries if the cache is full
+        """
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self.data) > self.maxsize:
+                    self.data.popitem(last=False)
+
+    def remove(self, key):
+        """Forget one entry, do nothing if the key is unknown"""
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        """Forget all the entries and reset the statistics"""
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = 0
+
+    def cache_info(self):
+        """Return the statistics as ``functools.lru_cache`` does"""
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self.data))
+
+
+def is_closed_registry(registry):
+    """Return True if the registry is garbage collected, or closed: a
+    registry given by the ``RegistryManager`` is closed when the manager
+    does not know it anymore"""
+    if registry is None:
+        return True
+
+    db_name = getattr(registry, 'db_name', None)
+    if db_name is None:
+        return False
+
+    from anyblok.registry import RegistryManager
+    return RegistryManager.registries.get(db_name) is not registry
+
+
+class SchemaCache(LRUCache):
+    """Process wide cache of the schema classes generated by ``SchemaWrapper``
+
+    The key of an entry is the tuple::
+
+        (registry, model, required_fields, Schema)
+
+    where ``Schema`` is the mixin class defined on the wrapper. The
+    ``only_primary_key`` option is given to the schema instance, the
+    schema class is the same.
+
+    The registry is saved by weak reference. The entries of the closed or
+    garbage collected registries are forgotten before a new schema class
+    is saved, or by ``release_closed_registries``, so the registries
+    opened and closed by the tests or by multi-tenant workers do not stay
+    in memory
+
+    ``get_or_build`` reads the saved classes without lock, and builds a
+    missing class once even if many threads want it at the same time. The
+    hits of the reads without lock are counted without lock too, the
+    statistics can be a bit under the real number of hits
+    """
+
+    def __init__(self, maxsize=128):
+        super(SchemaCache, self).__init__(maxsize=maxsize)
+        self.building = {}
+
+    def get_key(self, key):
+        return (ref(key[0]),) + tuple(key[1:])
+
+    def __contains__(self, key):
+        return self.get_key(key) in self.data
+
+    def get(self, key, default=None):
+        return super(SchemaCache, self).get(self.get_key(key), default)
+
+    def set(self, key, value):
+        with self.lock:
+            self.release_closed_registries()
+            super(SchemaCache, self).set(self.get_key(key), value)
+
+    def remove(self, key):
+        super(SchemaCache, self).remove(self.get_key(key))
+
+    def get_valid(self, key, is_valid=None):
+        """Return the saved value of the internal key without lock, None
+        if it is missing or not valid"""
+        value = self.data.get(key)
+        if value is None or (is_valid is not None and not is_valid(value)):
+            return None
+
+        self.hits += 1
+        try:
+            self.data.move_to_end(key)
+        except KeyError:
+            pass  # forgotten by another thread
+
+        return value
+
+    def get_or_build(self, key, build, is_valid=None):
+        """Return the saved schema class of the key, or build and save it
+
+        The first thread which misses the cache builds the class, the other
+        threads which want the same key wait and get the saved class. The
+        classes of different keys are built at the same time
+
+        :param build: function without argument which returns the class
+        :param is_valid: function which returns False if the saved class
+                         is obsolete and must be built again
+        """
+        data_key = self.get_key(key)
+        value = self.get_valid(data_key, is_valid)
+        if value is not None:
+            return value
+
+        with self.lock:
+            building = self.building.setdefault(data_key, RLock())
+
+        try:
+            with building:
+                value = self.get_valid(data_key, is_valid)
+                if value is None:
+                    with self.lock:
+                        self.misses += 1
+
+                    value = build()
+                    self.set(key, value)
+
+                return value
+        finally:
+            with self.lock:
+                if self.building.get(data_key) is building:
+                    del self.building[data_key]
+
+    def release_closed_registries(self):
+        """Forget the entries of the closed or garbage collected registries
+
+        Only the entries are removed, the classes are not changed because
+        they can still be used by the schema instances of other wrappers
+        """
+        with self.lock:
+            for key in [x for x in self.data if is_closed_registry(x[0]())]:
+                del self.data[key]
+
+    def invalidate(self, registry=None):
+        """Forget the generated schema classes
+
+        Must be called when a registry is reloaded, because the AnyBlok
+        models are built again
+
+        :param registry: forget only the entries of this registry, all
+                         the entries if None
+        """
+        with self.lock:
+            if registry is None:
+                self.data.clear()
+                return
+
+            for key in [x for x in self.data if x[0]() is registry]:
+                del self.data[key]
+
+
+class InstanceCache(LRUCache):
+    """Cache of the instances found by ``PostLoadSchema`` and
+    ``InstanceField``
+
+    The cache is opt-in and must live only during one transaction, it is
+    given by the context of the schema::
+
+        cache = InstanceCache(maxsize=10000)
+        context = {'registry': registry, 'instance_cache': cache}
+        CustomerSchema(context=context).load(customers, many=True)
+        AddressSchema(context=context).load(addresses, many=True)
+
+    The positive and negative lookups are saved, the key is the model,
+    the filtered fields and their values, the value is the list of the
+    instances found
+    """
+
+    def __init__(self, maxsize=10000):
+        super(InstanceCache, self).__init__(maxsize=maxsize)
+
+    def get_instances(self, Model, fields, values):
+        """Return the list of the instances or None if unknown
+
+        :param Model: AnyBlok model
+        :param fields: tuple of the filtered fields
+        :param values: tuple of the value of the fields
+        """
+        return self.get((Model.__registry_name__, tuple(fields), values))
+
+    def set_instances(self, Model, fields, values, instances):
+        """Save the list of the instances found"""
+        self.set((Model.__registry_name__, tuple(fields), values),
+                 instances)
+
+
+schema_cache = SchemaCache(maxsize=512)
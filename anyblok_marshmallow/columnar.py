@@ -0,0 +1,223 @@
+# This file is a part of the AnyBlok / Marshmallow api project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import json
+from itertools import islice
+from marshmallow.fields import (
+    Boolean, Date, DateTime, Decimal, Integer, List, Nested, Number, String,
+    Time, TimeDelta
+)
+from marshmallow.utils import from_iso_date, from_iso_datetime, from_iso_time
+from .render import default
+
+
+ISO_FORMATS = (None, 'iso', 'iso8601')
+
+
+def keep(value):
+    return value
+
+
+def convert_with(func):
+    """Return the converter which applies the function on the values
+    which are not None"""
+    def convert(value):
+        return None if value is None else func(value)
+
+    return convert
+
+
+def to_json(value):
+    """Return the JSON of the value, the str are kept"""
+    if isinstance(value, str):
+        return value
+
+    return json.dumps(value, default=default)
+
+
+def get_nested_schema(field):
+    """Return the real schema of the Nested field"""
+    from .schema import SchemaWrapper
+    schema = field.schema
+    if isinstance(schema, SchemaWrapper):
+        schema = schema.schema
+
+    return schema
+
+
+def get_column_plan(pa, schema):
+    """Return the list of (name, arrow type, converter) of the dump fields
+
+    The converter changes the dumped value into the value of the arrow
+    type. The arrow types only depend on the fields, so all the batches
+    have the same types whatever their values
+    """
+    return [
+        (field.data_key or attr_name,) + get_field_plan(pa, field)
+        for attr_name, field in schema.dump_fields.items()
+    ]
+
+
+def get_struct_plan(pa, schema):
+    """Return the arrow struct type and the converter of a nested schema"""
+    plan = get_column_plan(pa, schema)
+    type_ = pa.struct([pa.field(x[0], x[1]) for x in plan])
+    converters = [(x[0], x[2]) for x in plan]
+
+    def convert(value):
+        return {x: y(value.get(x)) for x, y in converters}
+
+    return type_, convert_with(convert)
+
+
+def get_list_plan(pa, type_, converter):
+    """Return the arrow list type and the converter of a collection"""
+    def convert(values):
+        return [converter(x) for x in values]
+
+    return pa.list_(type_), convert_with(convert)
+
+
+def get_number_plan(type_):
+    """Return the function which gives the plan of a number field, the
+    numbers dumped as string are saved as string"""
+    def get_plan(pa, field):
+        if field.as_string:
+            return pa.string(), keep
+
+        return getattr(pa, type_)(), keep
+
+    return get_plan
+
+
+def get_decimal_plan(pa, field):
+    if field.as_string or field.places is None:
+        return pa.string(), convert_with(str)
+
+    # places is saved as the exponent of quantize: Decimal('0.01')
+    scale = -field.places.as_tuple().exponent
+    return pa.decimal128(38, scale), keep
+
+
+def get_date_plan(pa, field):
+    if field.format in ISO_FORMATS:
+        return pa.date32(), convert_with(from_iso_date)
+
+    return pa.string(), keep
+
+
+def get_datetime_plan(pa, field):
+    if field.format in ISO_FORMATS:
+        return pa.timestamp('us'), convert_with(from_iso_datetime)
+
+    return pa.string(), keep
+
+
+SCALAR_PLANS = [
+    (Boolean, lambda pa, field: (pa.bool_(), keep)),
+    (TimeDelta, lambda pa, field: (pa.int64(), keep)),
+    (Decimal, get_decimal_plan),
+    (Integer, get_number_plan('int64')),
+    (Number, get_number_plan('float64')),
+    (Date, get_date_plan),
+    (DateTime, get_datetime_plan),
+    (Time, lambda pa, field: (pa.time64('us'), convert_with(from_iso_time))),
+    (String, lambda pa, field: (pa.string(), keep)),
+]
+
+
+def get_field_plan(pa, field):
+    """Return the arrow type and the converter of the dumped value of the
+    field
+
+    The values of the other fields (``Raw``, ``Function``, ...) are saved
+    as JSON strings
+    """
+    if isinstance(field, Nested):
+        type_, converter = get_struct_plan(pa, get_nested_schema(field))
+        if field.many:
+            return get_list_plan(pa, type_, converter)
+
+        return type_, converter
+    elif isinstance(field, List):
+        return get_list_plan(pa, *get_field_plan(pa, field.inner))
+
+    for field_types, get_plan in SCALAR_PLANS:
+        if isinstance(field, field_types):
+            return get_plan(pa, field)
+
+    return pa.string(), convert_with(to_json)
+
+
+def iter_batches(iterable, batch_size):
+    """Yield the lists of ``batch_size`` items of the iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+
+        yield batch
+
+
+def iter_record_batches(schema, dump, iterable, batch_size=10000):
+    """Yield the arrow record batches of the dump of the items
+
+    The items are dumped by batch of ``batch_size``, only the dump of one
+    batch is kept in memory. The types are given by the fields
+
+    :param schema: real schema
+    :param dump: function which dumps a list of items
+    """
+    import pyarrow as pa
+    plan = get_column_plan(pa, schema)
+    names = [x[0] for x in plan]
+    empty = True
+    for batch in iter_batches(iterable, batch_size):
+        data = dump(batch)
+        empty = False
+        yield pa.RecordBatch.from_arrays(
+            [
+                pa.array([converter(x.get(name)) for x in data], type=type_)
+                for name, type_, converter in plan
+            ],
+            names=names)
+
+    if empty:
+        yield pa.RecordBatch.from_arrays(
+            [pa.array([], type=x[1]) for x in plan], names=names)
+
+
+def dump_table(schema, dump, iterable, batch_size=10000):
+    """Return the arrow table of the dump of the items"""
+    import pyarrow as pa
+    return pa.Table.from_batches(
+        list(iter_record_batches(schema, dump, iterable, batch_size)))
+
+
+def dump_parquet(schema, dump, iterable, where, batch_size=10000, **kwargs):
+    """Write the dump of the items in a Parquet file, batch by batch
+
+    :param where: path or file like of the Parquet file
+    :rtype: int, number of rows written
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    nb_rows = 0
+    try:
+        for batch in iter_record_batches(schema, dump, iterable, batch_size):
+            if writer is None:
+                writer = pq.ParquetWriter(where, batch.schema, **kwargs)
+
+            writer.write_table(pa.Table.from_batches([batch]))
+            nb_rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return nb_rows
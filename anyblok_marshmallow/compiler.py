@@ -0,0 +1,479 @@
+# This file is a part of the AnyBlok / Marshmallow api project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from collections.abc import Mapping
+from marshmallow import Schema, missing, EXCLUDE, INCLUDE, RAISE
+from marshmallow.decorators import PRE_DUMP, POST_DUMP
+from marshmallow.exceptions import ValidationError
+from marshmallow.fields import Field, Number, Integer, String, Boolean, Raw
+from marshmallow.fields import Nested as FieldNested
+from marshmallow.utils import (
+    ensure_text_type, is_iterable_but_not_string, is_collection, set_value)
+from .validate import OneOf
+
+
+def serialize_expression(field, index):
+    """Return the python expression which serialize ``value`` for the field
+
+    The expression is inlined for the basic fields which do not overwrite
+    ``_serialize``, the other fields call their own ``_serialize``
+    """
+    cls = type(field)
+    if cls._serialize is Raw._serialize:
+        return 'value'
+    elif cls._serialize is String._serialize:
+        return ('None if value is None else '
+                '(value if type(value) is str else ensure_text(value))')
+    elif (
+        cls._serialize is Number._serialize and
+        cls._format_num is Number._format_num and
+        not field.as_string
+    ):
+        return 'None if value is None else num_type_%d(value)' % index
+
+    return 'serialize_%d(value, attr_%d, obj)' % (index, index)
+
+
+def is_compiled_field(field):
+    """Return True if the value of the field is got by ``getattr``"""
+    cls = type(field)
+    attribute = field.attribute
+    return (
+        field._CHECK_ATTRIBUTE and
+        cls.serialize is Field.serialize and
+        cls.get_value is Field.get_value and
+        (attribute is None or '.' not in attribute)
+    )
+
+
+def value_lines(field, index, indent):
+    """Lines which serialize ``value`` and save it in the result"""
+    from .schema import SchemaWrapper
+    if (
+        type(field)._serialize is FieldNested._serialize and
+        isinstance(field.schema, SchemaWrapper)
+    ):
+        lines = [
+            'if value is not None:',
+            '    nested = field_%d.schema' % index,
+            '    value = nested.dump(',
+            '        value, many=field_%d.many or nested.many,' % index,
+            '        compiled_dump=True)',
+            'res[key_%d] = value' % index,
+        ]
+    else:
+        lines = ['res[key_%d] = %s' % (
+            index, serialize_expression(field, index))]
+
+    return [indent + x for x in lines]
+
+
+def field_lines(field, index, attr_name, namespace):
+    """Return the lines of the dump function for one field"""
+    key = field.data_key if field.data_key is not None else attr_name
+    namespace.update({
+        'field_%d' % index: field,
+        'attr_%d' % index: attr_name,
+        'key_%d' % index: key,
+    })
+    if not is_compiled_field(field):
+        return [
+            '    value = field_%d.serialize(' % index,
+            '        attr_%d, obj, accessor=accessor)' % index,
+            '    if value is not missing:',
+            '        res[key_%d] = value' % index,
+        ]
+
+    namespace.update({
+        'attribute_%d' % index: field.attribute or attr_name,
+        'serialize_%d' % index: field._serialize,
+        'num_type_%d' % index: getattr(field, 'num_type', None),
+        'default_%d' % index: field.default,
+    })
+    lines = ['    value = getattr(obj, attribute_%d, missing)' % index]
+    if field.default is missing:
+        lines.append('    if value is not missing:')
+        return lines + value_lines(field, index, ' ' * 8)
+
+    default = 'default_%d' % index
+    if callable(field.default):
+        default += '()'
+
+    lines.extend([
+        '    if value is missing:',
+        '        value = %s' % default,
+    ])
+    return lines + value_lines(field, index, ' ' * 4)
+
+
+def compile_dump(schema):
+    """Generate the function which serializes one object for the schema
+
+    The function does the same thing as ``schema._serialize`` with the
+    loop over the fields unrolled. None is returned when the schema can
+    not be compiled, if it has some dump processors or if it overwrites
+    ``get_attribute``
+    """
+    if (
+        schema._has_processors(PRE_DUMP) or
+        schema._has_processors(POST_DUMP) or
+        type(schema).get_attribute is not Schema.get_attribute
+    ):
+        return None
+
+    namespace = {
+        'missing': missing,
+        'dict_class': schema.dict_class,
+        'ensure_text': ensure_text_type,
+        'accessor': schema.get_attribute,
+        'generic': schema._serialize,
+    }
+    lines = [
+        'def dump_one(obj):',
+        '    if hasattr(obj, "__getitem__"):',
+        '        return generic(obj)',
+        '    res = dict_class()',
+    ]
+    for index, (attr_name, field) in enumerate(schema.dump_fields.items()):
+        lines.extend(field_lines(field, index, attr_name, namespace))
+
+    lines.append('    return res')
+    code = compile('\n'.join(lines), '<dump %s>' % type(schema).__name__,
+                   'exec')
+    exec(code, namespace)
+    return namespace['dump_one']
+
+
+def compile_row_dump(schema, formatters):
+    """Generate the function which serializes one row of columns
+
+    The row has one column by dump field, in the order of
+    ``schema.dump_fields``, all of them must be compiled fields. The
+    formatter, if given, converts the value of the column as the getter
+    of the model does
+    """
+    if (
+        schema._has_processors(PRE_DUMP) or
+        schema._has_processors(POST_DUMP)
+    ):
+        return None
+
+    namespace = {'dict_class': schema.dict_class,
+                 'ensure_text': ensure_text_type}
+    lines = ['def dump_row(obj):', '    res = dict_class()']
+    for index, (attr_name, field) in enumerate(schema.dump_fields.items()):
+        key = field.data_key if field.data_key is not None else attr_name
+        namespace.update({
+            'attr_%d' % index: attr_name,
+            'key_%d' % index: key,
+            'serialize_%d' % index: field._serialize,
+            'num_type_%d' % index: getattr(field, 'num_type', None),
+            'format_%d' % index: formatters[index],
+        })
+        if formatters[index] is None:
+            lines.append('    value = obj[%d]' % index)
+        else:
+            lines.append('    value = format_%d(obj[%d])' % (index, index))
+
+        lines.append('    res[key_%d] = %s' % (
+            index, serialize_expression(field, index)))
+
+    lines.append('    return res')
+    code = compile('\n'.join(lines), '<dump row %s>' % type(schema).__name__,
+                   'exec')
+    exec(code, namespace)
+    return namespace['dump_row']
+
+
+def get_dump_function(schema):
+    """Return the compiled function of the schema, it is compiled once by
+    schema instance"""
+    try:
+        return schema._compiled_dump
+    except AttributeError:
+        schema._compiled_dump = compile_dump(schema)
+        return schema._compiled_dump
+
+
+def dump(schema, obj, *, many=None):
+    """Same as ``schema.dump`` with the compiled function"""
+    dump_one = get_dump_function(schema)
+    if dump_one is None:
+        return schema.dump(obj, many=many)
+
+    many = schema.many if many is None else bool(many)
+    if many and obj is not None:
+        if not is_iterable_but_not_string(obj):
+            return schema.dump(obj, many=many)
+
+        return [dump_one(x) for x in obj]
+
+    return dump_one(obj)
+
+
+def dumps(schema, obj, *args, many=None, **kwargs):
+    """Same as ``schema.dumps`` with the compiled function"""
+    serialized = dump(schema, obj, many=many)
+    return schema.opts.render_module.dumps(serialized, *args, **kwargs)
+
+
+def dump_iter(schema, iterable, *, compiled=True):
+    """Yield the dump of the items of the iterable one by one
+
+    The items are consumed only when the result is iterated, the memory
+    used does not depend on the number of items. The processors with
+    ``pass_many=True`` are called for each item
+    """
+    dump_one = get_dump_function(schema) if compiled else None
+    if dump_one is None:
+        for obj in iterable:
+            yield schema.dump(obj, many=False)
+    else:
+        for obj in iterable:
+            yield dump_one(obj)
+
+
+def render_iter(render_module, serialized, *args, ndjson=False, **kwargs):
+    """Yield the chunks of the JSON array of the serialized items, or one
+    line by item if ``ndjson`` is True"""
+    render = render_module.dumps
+    if ndjson:
+        for data in serialized:
+            yield render(data, *args, **kwargs) + '\n'
+
+        return
+
+    separator = kwargs.get('separators', (', ', ': '))[0]
+    yield '['
+    prefix = ''
+    for data in serialized:
+        yield prefix + render(data, *args, **kwargs)
+        prefix = separator
+
+    yield ']'
+
+
+def sub_partial(partial, prefix):
+    """Return the partial of the nested field, as marshmallow does"""
+    return [x[len(prefix):] for x in partial if x.startswith(prefix)]
+
+
+#: fast conditions for which ``raw`` is hashable
+HASHABLE_CONDITIONS = (
+    'type(raw) is str',
+    'type(raw) is int',
+    'raw is True or raw is False',
+)
+
+
+def fast_condition(field):
+    """Return the python condition on ``raw`` for which the deserialized
+    value is ``raw`` itself, None if the field has no fast path"""
+    cls = type(field)
+    if cls.deserialize is not Field.deserialize:
+        return None
+    elif cls._deserialize is Field._deserialize:
+        return 'raw is not None and raw is not missing'
+    elif cls._deserialize is String._deserialize:
+        return 'type(raw) is str'
+    elif (
+        cls._deserialize is Number._deserialize and
+        cls._validated is Integer._validated and
+        cls._format_num is Number._format_num and
+        field.num_type is int
+    ):
+        return 'type(raw) is int'
+    elif cls._deserialize is Boolean._deserialize and (
+        not field.truthy or (
+            True in field.truthy and
+            False not in field.truthy and
+            False in field.falsy
+        )
+    ):
+        return 'raw is True or raw is False'
+
+    return None
+
+
+def set_line(field, index, attr_name):
+    """Line which saves ``value`` in the result"""
+    if '.' in (field.attribute or attr_name):
+        return 'set_value(ret, set_%d, value)' % index
+
+    return 'ret[set_%d] = value' % index
+
+
+def generic_lines(field, index, attr_name):
+    """Lines which deserialize ``raw`` with ``field.deserialize``"""
+    return [
+        'try:',
+        '    value = deserialize_%d(' % index,
+        '        raw, key_%d, data, partial=(' % index,
+        '            sub_partial(partial, prefix_%d)' % index,
+        '            if partial_is_collection else partial))',
+        'except ValidationError as error:',
+        '    store_error(error.messages, key_%d, index=index)' % index,
+        '    value = error.valid_data or missing',
+        'if value is not missing:',
+        '    ' + set_line(field, index, attr_name),
+    ]
+
+
+def fast_lines(field, index, attr_name, condition):
+    """Lines which validate ``raw`` when it is already deserialized
+
+    The membership of ``OneOf`` is inlined only if the fast condition
+    guarantees a hashable ``raw``, the other values are checked by the
+    validator, which gives the error of marshmallow
+    """
+    validators = field.validators
+    set_value = set_line(field, index, attr_name)
+    if type(field)._validate is not Field._validate:
+        pass
+    elif not validators:
+        return ['value = raw', set_value]
+    elif (
+        condition in HASHABLE_CONDITIONS and
+        len(validators) == 1 and
+        isinstance(validators[0], OneOf) and
+        validators[0].choices_set is not None
+    ):
+        return [
+            'if raw in choices_%d:' % index,
+            '    value = raw',
+            '    ' + set_value,
+            'else:',
+            '    store_error([validator_%d._format_error(raw)], key_%d, '
+            'index=index)' % (index, index),
+        ]
+
+    return [
+        'try:',
+        '    validate_%d(raw)' % index,
+        'except ValidationError as error:',
+        '    store_error(error.messages, key_%d, index=index)' % index,
+        'else:',
+        '    value = raw',
+        '    ' + set_value,
+    ]
+
+
+def load_field_lines(field, index, attr_name, namespace):
+    """Return the lines of the deserialize function for one field"""
+    key = field.data_key if field.data_key is not None else attr_name
+    namespace.update({
+        'key_%d' % index: key,
+        'attr_%d' % index: attr_name,
+        'set_%d' % index: field.attribute or attr_name,
+        'prefix_%d' % index: key + '.',
+        'deserialize_%d' % index: field.deserialize,
+        'validate_%d' % index: field._validate,
+    })
+    if len(field.validators) == 1 and isinstance(field.validators[0], OneOf):
+        namespace['validator_%d' % index] = field.validators[0]
+        namespace['choices_%d' % index] = field.validators[0].choices_set
+
+    lines = [
+        'raw = get(key_%d, missing)' % index,
+        'if raw is missing and (partial is True or (',
+        '        partial_is_collection and attr_%d in partial)):' % index,
+        '    pass',
+    ]
+    cls = type(field)
+    if (
+        cls.deserialize is Field.deserialize and
+        cls._validate_missing is Field._validate_missing and
+        not field.required and
+        field.missing is missing
+    ):
+        lines.extend(['elif raw is missing:', '    pass'])
+
+    condition = fast_condition(field)
+    if condition is not None:
+        lines.append('elif %s:' % condition)
+        lines.extend('    ' + x for x in fast_lines(
+            field, index, attr_name, condition))
+
+    lines.append('else:')
+    lines.extend('    ' + x for x in generic_lines(field, index, attr_name))
+    return ['    ' + x for x in lines]
+
+
+def compile_load(schema):
+    """Generate the function which replaces ``schema._deserialize``
+
+    The loop over the fields is unrolled, the fields whose raw value is
+    already of the good type (str for String, int for Integer, ...) are
+    only validated, the ``OneOf`` of the Selection columns is inlined.
+    The other fields and the invalid values go through
+    ``field.deserialize``, so the errors are the same as marshmallow ones.
+    The processors and the schema validators are not changed
+    """
+    load_fields = schema.load_fields
+    namespace = {
+        'missing': missing,
+        'dict_class': schema.dict_class,
+        'Mapping': Mapping,
+        'ValidationError': ValidationError,
+        'is_collection': is_collection,
+        'set_value': set_value,
+        'sub_partial': sub_partial,
+        'EXCLUDE': EXCLUDE,
+        'INCLUDE': INCLUDE,
+        'RAISE': RAISE,
+        'index_errors': schema.opts.index_errors,
+        'type_error': schema.error_messages["type"],
+        'unknown_error': schema.error_messages["unknown"],
+        'fields_keys': frozenset(
+            field.data_key if field.data_key is not None else attr_name
+            for attr_name, field in load_fields.items()),
+    }
+    lines = [
+        'def deserialize(data, *, error_store, many=False, partial=False,',
+        '                unknown=RAISE, index=None):',
+        '    index = index if index_errors else None',
+        '    if many:',
+        '        if not is_collection(data):',
+        '            error_store.store_error([type_error], index=index)',
+        '            return []',
+        '        return [',
+        '            deserialize(x, error_store=error_store, partial=partial,',
+        '                        unknown=unknown, index=i)',
+        '            for i, x in enumerate(data)]',
+        '    ret = dict_class()',
+        '    if not isinstance(data, Mapping):',
+        '        error_store.store_error([type_error], index=index)',
+        '        return ret',
+        '    store_error = error_store.store_error',
+        '    get = data.get',
+        '    partial_is_collection = is_collection(partial)',
+    ]
+    for index, (attr_name, field) in enumerate(load_fields.items()):
+        lines.extend(load_field_lines(field, index, attr_name, namespace))
+
+    lines.extend([
+        '    if unknown != EXCLUDE:',
+        '        for key in set(data) - fields_keys:',
+        '            if unknown == INCLUDE:',
+        '                set_value(ret, key, data[key])',
+        '            elif unknown == RAISE:',
+        '                store_error([unknown_error], key, index)',
+        '    return ret',
+    ])
+    code = compile('\n'.join(lines), '<load %s>' % type(schema).__name__,
+                   'exec')
+    exec(code, namespace)
+    return namespace['deserialize']
+
+
+def install_load(schema):
+    """Replace the ``_deserialize`` method of the schema instance by the
+    compiled function, if the schema does not overwrite it"""
+    if type(schema)._deserialize is Schema._deserialize:
+        schema._deserialize = compile_load(schema)
+
+    return schema
@@ -8,10 +8,14 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 from marshmallow.exceptions import ValidationError
 from marshmallow.base import FieldABC
-from marshmallow.validate import OneOf
+from .validate import OneOf
+from .cache import LRUCache
 from base64 import b64encode, b64decode
+from copy import copy
+from sqlalchemy.orm.exc import MultipleResultsFound
 from sqlalchemy_utils import PhoneNumber as PN
 from enum import Enum, unique
+from threading import RLock
 from marshmallow.fields import (  # noqa
     Field,
     Raw,
@@ -54,12 +58,19 @@ class Nested(FieldNested):
 
     @property
     def schema(self):
-        """Overload the super property to remove cache
+        """Overload the super property to propagate the context
 
-        it is the only way to propagate the context at each call
+        The nested schema is built only once by parent schema instance,
+        at each call only the context of the parent is propagated
         """
-        self._schema = None
-        return super(Nested, self).schema
+        if self._schema is None:
+            return super(Nested, self).schema
+
+        context = getattr(self.parent, 'context', {})
+        if self._schema.context is not context:
+            self._schema.context.update(context)
+
+        return self._schema
 
     def _deserialize(self, value, attr, data, **kwargs):
         if (
@@ -174,11 +185,73 @@ class JsonCollection(Field):
 
 
 class PhoneNumber(String):
+    """Phone number field, the value is parsed by ``phonenumbers``
+
+    The parsed numbers are kept in the ``cache`` class attribute, an
+    ``LRUCache`` by raw string and region, and their validity in the
+    ``valid_cache`` class attribute, an ``LRUCache`` by E.164 number::
+
+        PhoneNumber.cache = LRUCache(maxsize=100000)
+        PhoneNumber.cache.cache_info()
+
+    Each load gets its own copy of the cached number
+    """
+
+    cache = LRUCache(maxsize=4096)
+    valid_cache = LRUCache(maxsize=4096)
 
     def __init__(self, region=None, *args, **kwargs):
         self.region = region
         super(PhoneNumber, self).__init__(*args, **kwargs)
 
+    @staticmethod
+    def copy_number(number):
+        """Return a copy of the phone number which can be changed"""
+        res = copy(number)
+        res._phone_number = copy(number._phone_number)
+        return res
+
+    @classmethod
+    def parse(cls, value, region):
+        """Return the phone number, None if the value can not be parsed
+
+        :param value: raw string of the phone number
+        :param region: default region of the phone number
+        """
+        if not isinstance(value, str):
+            try:
+                return PN(value, region)
+            except Exception:
+                return None
+
+        key = (value, region)
+        entry = cls.cache.get(key)
+        if entry is None:
+            try:
+                number = PN(value, region)
+            except Exception:
+                number = None
+            else:
+                cls.valid_cache.set(number.e164, number.is_valid_number())
+
+            entry = (number,)
+            cls.cache.set(key, entry)
+
+        if entry[0] is None:
+            return None
+
+        return cls.copy_number(entry[0])
+
+    @classmethod
+    def is_valid(cls, number):
+        """Return the validity of the phone number"""
+        valid = cls.valid_cache.get(number.e164)
+        if valid is None:
+            valid = number.is_valid_number()
+            cls.valid_cache.set(number.e164, valid)
+
+        return valid
+
     def _serialize(self, value, attr, obj):
         if value is not None and isinstance(value, PN):
             return value.international
@@ -188,9 +261,8 @@ class PhoneNumber(String):
     def _deserialize(self, value, attr, data, **kwargs):
         if value is not None:
             region = self.context.get('region', self.region)
-            try:
-                return PN(value, region)
-            except Exception:
+            value = self.parse(value, region)
+            if value is None:
                 raise ValidationError(
                     'The string supplied did not seem to be a phone number.'
                 )
@@ -202,7 +274,7 @@ class PhoneNumber(String):
             return
 
         if isinstance(value, PN):
-            if not value.is_valid_number():
+            if not self.is_valid(value):
                 raise ValidationError({'valid': 'Is not a valid number'})
         else:
             raise ValidationError(
@@ -239,30 +311,66 @@ class Country(String):
 
         super(Country, self).__init__(*args, **kwargs)
 
+    tables = None
+    tables_lock = RLock()
+
+    @classmethod
+    def warm_up(cls):
+        """Build the lookup tables of the countries
+
+        The tables are built by the first load or dump, call this method
+        at the start of the worker to not pay the cost during a request
+        """
+        with cls.tables_lock:
+            if cls.tables is not None:
+                return cls.tables
+
+            import pycountry
+
+            tables = {mode: {} for mode in Country.Modes}
+            lower_tables = {mode: {} for mode in Country.Modes}
+            for country in pycountry.countries:
+                for mode in Country.Modes:
+                    value = getattr(country, mode.value, None)
+                    if not value:
+                        continue
+
+                    tables[mode].setdefault(value, country)
+                    lower_tables[mode].setdefault(value.lower(), country)
+
+            cls.tables = (tables, lower_tables)
+            return cls.tables
+
+    @classmethod
+    def lookup(cls, mode, value):
+        """Return the pycountry country or None if the value is unknown
+
+        :param mode: ``Country.Modes`` entry of the value
+        :param value: str, the case is ignored if no country matches
+                      exactly
+        """
+        if not isinstance(value, str):
+            return None
+
+        tables, lower_tables = cls.tables or cls.warm_up()
+        country = tables[mode].get(value)
+        if country is None:
+            country = lower_tables[mode].get(value.lower())
+
+        return country
+
     def _serialize(self, value, attr, obj):
 
-        if value is not None and not isinstance(value, str):
+        if isinstance(value, str):
+            value = self.lookup(self.load_mode, value)
+
+        if value is not None:
             return getattr(value, self.dump_mode.value) or value
 
     def _deserialize(self, value, attr, data, **kwargs):
 
         if value is not None:
-
-            import pycountry
-
-            if self.load_mode == Country.Modes.ALPHA_3:
-                value = pycountry.countries.get(alpha_3=value)
-            elif self.load_mode == Country.Modes.ALPHA_2:
-                value = pycountry.countries.get(alpha_2=value)
-            elif self.load_mode == Country.Modes.NUMERIC:
-                value = pycountry.countries.get(numeric=value)
-            elif self.load_mode == Country.Modes.NAME:
-                value = pycountry.countries.get(name=value)
-            elif self.load_mode == Country.Modes.OFFICIAL_NAME:
-                value = pycountry.countries.get(official_name=value)
-            else:
-                value = None
-
+            value = self.lookup(self.load_mode, value)
             if value is None:
                 raise ValidationError('Not a valid country.')
 
@@ -310,6 +418,87 @@ class InstanceField(Field):
     def _deserialize(self, value, attr, data, **kwargs):
         return self.container.deserialize(value, attr=attr, data=data)
 
+    def get_prefetched_values(self):
+        """Return the values checked by ``InstanceFieldSchema``
+
+        :rtype: tuple (set of the checked values, dict {value: count}) or
+                None if the values were not prefetched
+        """
+        return self.context.get('instance_fields', {}).get(
+            (self.model, self.key))
+
+    def count_records(self, Model, values, size=None):
+        """Count the records for each value of the key
+
+        The values already checked by ``InstanceFieldSchema`` or saved in
+        the ``instance_cache`` of the context are not queried again
+
+        :param Model: AnyBlok model
+        :param values: list of the values of the key
+        :param size: if defined, query the values by chunk of this size
+        :rtype: dict {value: number of records}
+        """
+        counts = {}
+        prefetched = self.get_prefetched_values()
+        if prefetched:
+            checked, found = prefetched
+            counts.update({x: found.get(x, 0) for x in values if x in checked})
+
+        cache = self.context.get('instance_cache')
+        if cache is not None:
+            for value in values:
+                if value not in counts:
+                    instances = cache.get_instances(
+                        Model, (self.key,), (value,))
+                    if instances is not None:
+                        counts[value] = len(instances)
+
+        missing = list({x for x in values if x not in counts})
+        size = size or len(missing) or 1
+        for i in range(0, len(missing), size):
+            counts.update(
+                self.query_records(Model, missing[i:i + size], cache))
+
+        return counts
+
+    def query_records(self, Model, values, cache=None):
+        """Count the records for each value with one query, if the
+        ``instance_cache`` is given the instances found are saved in it
+
+        The rows are matched with the values by Python equality. A value
+        which is not matched, because the database converts or compares it
+        in another way (type of the column, collation), is checked alone
+        with ``filter_by``
+        """
+        column = getattr(Model, self.key)
+        if cache is None:
+            query = Model.query(self.key).filter(column.in_(values))
+            rows = [(x[0], x) for x in query.all()]
+        else:
+            query = Model.query().filter(column.in_(values))
+            rows = [(getattr(x, self.key), x) for x in query.all()]
+
+        if len(values) == 1:
+            # the database matched all the rows with the only value
+            found = {values[0]: [x[1] for x in rows]}
+        else:
+            found = {}
+            for value, record in rows:
+                found.setdefault(value, []).append(record)
+
+        counts = {}
+        for value in values:
+            records = found.get(value)
+            if records is None:
+                records = Model.query().filter_by(**{self.key: value}).all()
+
+            if cache is not None:
+                cache.set_instances(Model, (self.key,), (value,), records)
+
+            counts[value] = len(records)
+
+        return counts
+
     def _validate(self, value):
         registry = self.context['registry']
         Model = registry.get(self.model)
@@ -318,10 +507,10 @@ class InstanceField(Field):
             raise ValidationError("Field may not be null.")
 
         if isinstance(self.container, List):
-            valid = Model.query(self.key).filter(
-                        getattr(Model, self.key).in_(
-                            [v for v in value if v])).all()
-            valid_list = [v[0] for v in valid]
+            values = [v for v in value if v]
+            counts = self.count_records(Model, values)
+            valid_list = [
+                v for v in set(values) for i in range(counts.get(v, 0))]
 
             if not valid_list:
                 raise ValidationError(
@@ -333,8 +522,11 @@ class InstanceField(Field):
                     "Records with key %r = %r on %r not found" %
                     (self.key, delta, Model))
         else:
-            record = Model.query().filter_by(**{self.key: value}).one_or_none()
-            if not record:
+            count = self.count_records(Model, [value]).get(value, 0)
+            if count > 1:
+                raise MultipleResultsFound(
+                    "Multiple rows were found for one_or_none()")
+            if not count:
                 raise ValidationError(
                         "Record with key %r = %r on %r not found" %
                         (self.key, value, Model))
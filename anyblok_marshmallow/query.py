@@ -0,0 +1,262 @@
+# This file is a part of the AnyBlok / Marshmallow api project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from anyblok.common import anyblok_column_prefix
+from anyblok.field import Field as AnyBlokField
+from marshmallow.fields import Nested as FieldNested
+from sqlalchemy.orm import Load
+from sqlalchemy.orm.exc import UnmappedColumnError
+import sqlalchemy as sa
+from . import compiler
+
+
+def get_anyblok_field(Model, name):
+    """Return the AnyBlok field declared for the column, None if unknown"""
+    first_step = getattr(Model.registry, 'loaded_namespaces_first_step', {})
+    for namespace in [Model.__registry_name__] + list(Model.__depends__):
+        field = first_step.get(namespace, {}).get(name)
+        if field is not None:
+            return field
+
+    return None
+
+
+def get_formatter(Model, name):
+    """Return the function which formats the value of the column as the
+    getter of the hybrid property, None if the value is not changed"""
+    field = get_anyblok_field(Model, name)
+    if field is None or (
+        type(field).getter_format_value is AnyBlokField.getter_format_value
+    ):
+        return None
+
+    return field.getter_format_value
+
+
+def get_mapped_column(Model, name):
+    """Return the mapped attribute of the column, None if the field is not
+    a column of the model"""
+    column_attrs = sa.inspect(Model).column_attrs
+    for key in (anyblok_column_prefix + name, name):
+        if key in column_attrs:
+            return getattr(Model, key)
+
+    return None
+
+
+def get_mapped_relationship(Model, name):
+    """Return the mapped attribute of the relationship, None if the field
+    is not a relationship of the model"""
+    relationships = sa.inspect(Model).relationships
+    for key in (anyblok_column_prefix + name, name):
+        if key in relationships:
+            return getattr(Model, key)
+
+    return None
+
+
+def get_nested_schema(field):
+    """Return the real schema of the Nested field, None if the schema is
+    not a model schema"""
+    from .schema import SchemaWrapper
+    schema = field.schema
+    if isinstance(schema, SchemaWrapper):
+        schema = schema.schema
+
+    if getattr(schema.opts, 'model', None) is None:
+        return None
+
+    return schema
+
+
+def get_column_attributes(Model, columns):
+    """Return the mapped attributes of the table columns of the model, the
+    columns which are not mapped by the model are ignored"""
+    mapper = sa.inspect(Model)
+    attributes = []
+    for column in columns:
+        try:
+            prop = mapper.get_property_by_column(column)
+        except UnmappedColumnError:
+            continue
+
+        attributes.append(getattr(Model, prop.key))
+
+    return attributes
+
+
+def get_projected_columns(schema, relationship=None):
+    """Return the mapped columns needed to dump the schema
+
+    The primary keys, the columns of the dump fields, the foreign keys of
+    the dumped Many2One and the columns used by the relationship which
+    loads the instances are needed. None if all the columns are needed,
+    or if one dump field is not a column nor a relationship of the model
+    """
+    Model = schema.opts.model
+    columns = list(sa.inspect(Model).primary_key)
+    if relationship is not None:
+        columns.extend(relationship.property.remote_side)
+
+    attributes = get_column_attributes(Model, columns)
+    for attr_name, field in schema.dump_fields.items():
+        name = field.attribute or attr_name
+        attribute = get_mapped_relationship(Model, name)
+        if attribute is not None:
+            attributes.extend(get_column_attributes(
+                Model, attribute.property.local_columns))
+            continue
+
+        attribute = get_mapped_column(Model, name)
+        if attribute is None:
+            return None
+
+        attributes.append(attribute)
+
+    keys = {x.key for x in attributes}
+    if len(keys) == len(sa.inspect(Model).column_attrs):
+        return None
+
+    return [getattr(Model, x) for x in sorted(keys)]
+
+
+def get_loading_paths(schema, models=()):
+    """Return the paths of the relationships dumped by the schema
+
+    Each path is the tuple of the steps from the model of the schema to
+    the last nested schema, a step is the tuple of the mapped relationship
+    and the schema of the nested field. The recursion stops when a model
+    is already in the path
+    """
+    Model = schema.opts.model
+    models += (Model,)
+    paths = []
+    for attr_name, field in schema.dump_fields.items():
+        if not isinstance(field, FieldNested):
+            continue
+
+        attribute = get_mapped_relationship(
+            Model, field.attribute or attr_name)
+        if attribute is None:
+            continue
+
+        sub_schema = get_nested_schema(field)
+        sub_paths = []
+        if sub_schema is not None and sub_schema.opts.model not in models:
+            sub_paths = get_loading_paths(sub_schema, models)
+
+        step = (attribute, sub_schema)
+        paths.extend((step,) + x for x in sub_paths or [()])
+
+    return paths
+
+
+def get_loader_options(schema):
+    """Return the loader options of the relationships dumped by the schema
+
+    The collections are loaded by ``selectinload`` and the scalar
+    relationships by ``joinedload``, so the number of queries depends on
+    the nested schemas, not on the number of rows. Each loaded model only
+    loads the columns needed by its schema with ``load_only``. The options
+    are computed once by schema instance
+    """
+    try:
+        return schema._loader_options
+    except AttributeError:
+        pass
+
+    options = []
+    projected = set()
+    root = Load(schema.opts.model)
+    columns = get_projected_columns(schema)
+    if columns is not None:
+        options.append(root.load_only(*columns))
+
+    for path in get_loading_paths(schema):
+        option = root
+        for index, (attribute, sub_schema) in enumerate(path):
+            if attribute.property.uselist:
+                option = option.selectinload(attribute)
+            else:
+                option = option.joinedload(attribute)
+
+            key = tuple(x[0] for x in path[:index + 1])
+            if sub_schema is None or key in projected:
+                continue
+
+            projected.add(key)
+            columns = get_projected_columns(sub_schema, attribute)
+            if columns is not None:
+                options.append(option.load_only(*columns))
+
+        options.append(option)
+
+    schema._loader_options = options
+    return options
+
+
+def optimize_query(schema, query):
+    """Add the loader options of the relationships dumped by the schema"""
+    options = get_loader_options(schema)
+    if options:
+        query = query.options(*options)
+
+    return query
+
+
+def get_row_plan(schema):
+    """Return the columns to select and the formatters of their values,
+    None if one dump field is not a simple column of the model"""
+    Model = schema.opts.model
+    columns = []
+    formatters = []
+    for attr_name, field in schema.dump_fields.items():
+        if (
+            isinstance(field, FieldNested) or
+            not compiler.is_compiled_field(field)
+        ):
+            return None
+
+        name = field.attribute or attr_name
+        column = get_mapped_column(Model, name)
+        if column is None:
+            return None
+
+        columns.append(column)
+        formatters.append(get_formatter(Model, name))
+
+    dump_row = compiler.compile_row_dump(schema, formatters)
+    if dump_row is None:
+        return None
+
+    return columns, dump_row
+
+
+def get_row_dump(schema):
+    """Return the row plan of the schema, it is computed once by schema
+    instance"""
+    try:
+        return schema._row_dump
+    except AttributeError:
+        schema._row_dump = get_row_plan(schema)
+        return schema._row_dump
+
+
+def dump_query(schema, query):
+    """Dump the result of the query
+
+    Only the columns needed by the schema are selected, the rows are
+    serialized without ORM instance. If one dump field is not a column,
+    the instances of the query are dumped by the compiled dump, with the
+    loader options of the nested relationships
+    """
+    plan = get_row_dump(schema)
+    if plan is None:
+        return compiler.dump(schema, optimize_query(schema, query), many=True)
+
+    columns, dump_row = plan
+    return [dump_row(row) for row in query.with_entities(*columns)]
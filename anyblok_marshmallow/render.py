@@ -0,0 +1,238 @@
+# This file is a part of the AnyBlok / Marshmallow api project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import datetime as dt
+import decimal
+import json
+import uuid
+from marshmallow.utils import (
+    from_iso_date, from_iso_datetime, from_iso_time
+)
+
+
+def default(obj):
+    """Return the JSON value of the types which can stay in the dump of
+    the fields of ``TYPE_MAPPING``"""
+    if isinstance(obj, (uuid.UUID, decimal.Decimal)):
+        return str(obj)
+    elif isinstance(obj, (dt.datetime, dt.date, dt.time)):
+        return obj.isoformat()
+    elif isinstance(obj, dt.timedelta):
+        return obj.total_seconds()
+    elif isinstance(obj, (set, frozenset)):
+        return list(obj)
+
+    raise TypeError(
+        'Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+class JSONRender:
+    """Render module of the standard ``json`` library, which also encodes
+    the UUID, Decimal, datetime and timedelta values
+
+    The kwargs of ``dumps`` and ``loads`` are the ones of ``json``
+    """
+
+    def dumps(self, obj, *args, **kwargs):
+        kwargs.setdefault('default', default)
+        return json.dumps(obj, *args, **kwargs)
+
+    def loads(self, data, *args, **kwargs):
+        return json.loads(data, *args, **kwargs)
+
+
+class ORJSONRender:
+    """Render module of the ``orjson`` library, the result of ``dumps`` is
+    a str as for ``json``
+
+    ``dumps`` accepts the kwargs ``default`` and ``option`` of orjson, and
+    translates the kwargs of ``json.dumps`` which orjson can give:
+    ``indent=2``, ``sort_keys``, ``separators=(',', ':')`` and
+    ``ensure_ascii=False``. The other kwargs raise ``TypeError``
+
+    :exception ImportError: orjson is not installed
+    """
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def get_option(self, kwargs):
+        """Pop the kwargs of ``json.dumps`` and return the option of orjson
+        """
+        option = kwargs.pop('option', None) or 0
+        indent = kwargs.pop('indent', None)
+        if indent == 2:
+            option |= self.orjson.OPT_INDENT_2
+        elif indent is not None:
+            raise TypeError('orjson only indents by 2 spaces, not %r' % (
+                indent,))
+
+        if kwargs.pop('sort_keys', False):
+            option |= self.orjson.OPT_SORT_KEYS
+
+        separators = kwargs.pop('separators', None)
+        if separators is not None and tuple(separators) != (',', ':'):
+            raise TypeError(
+                "orjson only uses the separators (',', ':'), not %r" % (
+                    separators,))
+
+        if kwargs.pop('ensure_ascii', False):
+            raise TypeError('orjson does not escape the non ASCII chars')
+
+        unknown = set(kwargs) - {'default'}
+        if unknown:
+            raise TypeError('Unsupported kwargs by orjson: %s' % (
+                ', '.join(sorted(unknown))))
+
+        return option
+
+    def dumps(self, obj, *args, **kwargs):
+        kwargs['option'] = self.get_option(kwargs)
+        kwargs.setdefault('default', default)
+        return self.orjson.dumps(obj, *args, **kwargs).decode('utf-8')
+
+    def loads(self, data, *args, **kwargs):
+        return self.orjson.loads(data, *args, **kwargs)
+
+
+def text_ext(code, type_, encode, decode=None):
+    """Return the extension type whose data is the utf-8 of a str"""
+    return (
+        code, type_,
+        lambda x: encode(x).encode('utf-8'),
+        lambda x: (decode or str)(x.decode('utf-8'))
+    )
+
+
+def get_ext_types():
+    """Return the list of the MessagePack extension types, the tuples
+    (code, type, encode, decode)
+
+    The phone numbers, countries and colors are decoded as the str loaded
+    by their fields. The types of the libraries which are not installed
+    are ignored
+    """
+    ext_types = [
+        (1, uuid.UUID, lambda x: x.bytes, lambda x: uuid.UUID(bytes=x)),
+        text_ext(2, decimal.Decimal, str, decimal.Decimal),
+        text_ext(3, dt.datetime, dt.datetime.isoformat, from_iso_datetime),
+        text_ext(4, dt.date, dt.date.isoformat, from_iso_date),
+        text_ext(5, dt.time, dt.time.isoformat, from_iso_time),
+        text_ext(6, dt.timedelta, lambda x: repr(x.total_seconds()),
+                 lambda x: dt.timedelta(seconds=float(x))),
+    ]
+    try:
+        from sqlalchemy_utils import PhoneNumber
+        ext_types.append(text_ext(7, PhoneNumber, lambda x: x.e164))
+    except ImportError:
+        pass
+
+    try:
+        from pycountry.db import Data
+        ext_types.append(text_ext(8, Data, lambda x: x.alpha_3))
+    except ImportError:
+        pass
+
+    try:
+        from colour import Color
+        ext_types.append(text_ext(9, Color, lambda x: x.hex))
+    except ImportError:
+        pass
+
+    return ext_types
+
+
+class MsgPackRender:
+    """Render module of the ``msgpack`` library, ``dumps`` returns bytes
+
+    The values of the types given by ``get_ext_types`` are saved as
+    extension types. The kwargs of ``dumps`` and ``loads`` are the ones of
+    ``msgpack.packb`` and ``msgpack.unpackb``
+
+    :exception ImportError: msgpack is not installed
+    """
+
+    def __init__(self):
+        import msgpack
+        self.msgpack = msgpack
+        self.ext_types = get_ext_types()
+        self.decoders = {x[0]: x[3] for x in self.ext_types}
+
+    def default(self, obj):
+        # datetime is before date in the extension types
+        for code, type_, encode, decode in self.ext_types:
+            if isinstance(obj, type_):
+                return self.msgpack.ExtType(code, encode(obj))
+
+        if isinstance(obj, (set, frozenset)):
+            return list(obj)
+
+        raise TypeError(
+            'Object of type %s is not MessagePack serializable' % (
+                type(obj).__name__))
+
+    def ext_hook(self, code, data):
+        decode = self.decoders.get(code)
+        if decode is None:
+            return self.msgpack.ExtType(code, data)
+
+        return decode(data)
+
+    def dumps(self, obj, *args, **kwargs):
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('use_bin_type', True)
+        return self.msgpack.packb(obj, *args, **kwargs)
+
+    def loads(self, data, *args, **kwargs):
+        kwargs.setdefault('ext_hook', self.ext_hook)
+        kwargs.setdefault('raw', False)
+        return self.msgpack.unpackb(data, *args, **kwargs)
+
+
+renders = {
+    'json': JSONRender,
+    'orjson': ORJSONRender,
+    'msgpack': MsgPackRender,
+}
+render_instances = {}
+default_render = None
+
+
+def set_default_render(render):
+    """Define the render used by all the ``SchemaWrapper`` which do not
+    define their own render
+
+    :param render: name of a render of ``renders``, object with the
+                   methods ``dumps`` and ``loads``, or None to use the
+                   ``render_module`` of the marshmallow schemas
+    """
+    global default_render
+    default_render = get_render(render) if render is not None else None
+
+
+def get_render(render=None):
+    """Return the render object
+
+    :param render: name of a render of ``renders``, render object, or None
+                   for the default render
+    :rtype: object with the methods ``dumps`` and ``loads`` or None
+    """
+    if render is None:
+        return default_render
+    elif isinstance(render, str):
+        if render not in renders:
+            raise ValueError('Unknown render %r, available renders are %r' % (
+                render, sorted(renders)))
+
+        instance = render_instances.get(render)
+        if instance is None:
+            instance = render_instances[render] = renders[render]()
+
+        return instance
+
+    return render
@@ -6,7 +6,7 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
-from marshmallow import post_load, validates_schema, validate
+from marshmallow import post_load, pre_load, validates_schema
 from marshmallow_sqlalchemy.schema import (
     ModelSchema as MS,
     ModelSchemaOpts as MSO
@@ -15,25 +15,42 @@ from marshmallow_sqlalchemy.convert import ModelConverter as MC
 from anyblok.common import anyblok_column_prefix
 from marshmallow.exceptions import ValidationError
 from .exceptions import RegistryNotFound
+from .cache import is_closed_registry, schema_cache
+from . import columnar, compiler, stream
+from .query import dump_query, get_mapped_column, optimize_query
+from .render import get_render
+from .validate import get_selection_validator, get_country_validator
 from .fields import (
     Raw, Nested, Text, Email, URL, PhoneNumber, Country, String, DateTime,
-    Color, UUID, Float, Boolean, Integer, Time, Date, TimeDelta, Decimal
+    Color, UUID, Float, Boolean, Integer, Time, Date, TimeDelta, Decimal,
+    InstanceField, List
 )
 import anyblok
 import sqlalchemy as sa
 import sqlalchemy_utils.types as sau
 from marshmallow.base import SchemaABC
+from collections import namedtuple
+from copy import copy, deepcopy
+from threading import local, RLock
+from weakref import WeakKeyDictionary, ref
 import datetime as dt
 import uuid
 import decimal
-from functools import lru_cache
+import warnings
 
 
 def update_from_kwargs(*entries):
     """decorator to get temporaly the value in kwargs and put it in schema
 
+    .. deprecated:: 2.3.1
+        ``SchemaWrapper`` gives the options of a call by ``SchemaOptions``
+        without changing the wrapper, this decorator is not used anymore
+
     :params entries: array ok entry name to take from the kwargs
     """
+    warnings.warn(
+        "update_from_kwargs is deprecated, it changes the instance during "
+        "the call", DeprecationWarning, stacklevel=2)
 
     def wrap_function(f):
 
@@ -66,6 +83,47 @@ def format_fields(x):
     return x
 
 
+remote_wrappers = WeakKeyDictionary()
+remote_wrappers_lock = RLock()
+
+
+def get_remote_wrapper(registry, remote_model):
+    """Return the wrapper class and the primary keys used by the ``Nested``
+    fields generated for the relationships to the remote model
+
+    They are computed once by registry and remote model and shared by all
+    the conversions. The table of a registry is forgotten when the
+    registry is garbage collected, and an entry is built again when the
+    model is changed by a reload of the registry
+
+    :param registry: AnyBlok registry
+    :param remote_model: registry name of the remote model
+    :rtype: (SchemaWrapper subclass, tuple of the primary keys)
+    """
+    RemoteModel = registry.get(remote_model)
+    with remote_wrappers_lock:
+        table = remote_wrappers.setdefault(registry, {})
+        entry = table.get(remote_model)
+        if entry is None or entry[0]() is not RemoteModel:
+            wrapper = type(
+                'Model.Schema.' + remote_model,
+                (SchemaWrapper,),
+                {'model': remote_model}
+            )
+            # the model is saved by weak reference, it references the
+            # registry which is the key of the table
+            entry = table[remote_model] = (
+                ref(RemoteModel), wrapper,
+                tuple(RemoteModel.get_primary_keys()))
+
+        return entry[1], entry[2]
+
+
+base_fields_tables = WeakKeyDictionary()
+base_fields_building = {}
+base_fields_lock = RLock()
+
+
 class ModelConverter(MC):
     """Overwrite the ModelConverter class of marshmallow-sqlalchemy
 
@@ -88,7 +146,74 @@ class ModelConverter(MC):
     })
 
     def fields_for_model(self, Model, **kwargs):
-        """Overwrite the method and remove prefix of the field name"""
+        """Overwrite the method and remove prefix of the field name
+
+        The model is converted once by registry, model and options of the
+        conversion, see ``get_base_fields``. The schema gets copies of the
+        base fields, the ``required_fields`` are applied on the copies
+        """
+        required_fields = self.schema_cls.Meta.required_fields
+        fields = {}
+        for name, (field, column_name) in self.get_base_fields(
+            Model, **kwargs
+        ).items():
+            if field is not None:
+                field = copy(field)
+                if column_name is not None and (
+                    required_fields is True or (
+                        isinstance(required_fields, (tuple, list)) and
+                        column_name in required_fields)
+                ):
+                    field.required = True
+                    field.allow_none = False
+
+            fields[name] = field
+
+        return fields
+
+    def get_base_fields(self, Model, **kwargs):
+        """Return the base fields of the model, without the options of the
+        schema
+
+        The table is computed once by registry, model and options of the
+        conversion, and shared by the schemas generated with other
+        ``required_fields``, ``only_primary_key`` or mixin. The threads
+        which want the same table wait for the first one, the tables of
+        different keys are converted at the same time
+
+        :rtype: dict {field name: (field, name of the column or None)}
+        """
+        key = (
+            ref(Model),
+            kwargs.get('include_fk', False),
+            tuple(kwargs['fields']) if kwargs.get('fields') else None,
+            tuple(kwargs['exclude']) if kwargs.get('exclude') else None,
+            tuple(sorted(kwargs.get('base_fields') or ())),
+        )
+        with base_fields_lock:
+            tables = base_fields_tables.setdefault(Model.registry, {})
+            table = tables.get(key)
+            if table is not None:
+                return table
+
+            building = base_fields_building.setdefault(key, RLock())
+
+        try:
+            with building:
+                table = tables.get(key)
+                if table is None:
+                    table = self.convert_model(Model, **kwargs)
+                    with base_fields_lock:
+                        tables[key] = table
+
+                return table
+        finally:
+            with base_fields_lock:
+                if base_fields_building.get(key) is building:
+                    del base_fields_building[key]
+
+    def convert_model(self, Model, **kwargs):
+        """Convert the columns and relationships of the model"""
         res = super(ModelConverter, self).fields_for_model(Model, **kwargs)
         for field in Model.loaded_fields.keys():
             res[field] = Raw()
@@ -101,57 +226,119 @@ class ModelConverter(MC):
 
             type_ = fields_description[field]['type']
             if type_ == 'Selection':
-                validators = fields[field].validate
-                choices = list(dict(
-                    fields_description[field]['selections']).keys())
-                labels = list(dict(
-                    fields_description[field]['selections']).values())
-                validators.append(validate.OneOf(choices, labels=labels))
+                fields[field].validate.append(get_selection_validator(
+                    Model, field, fields_description[field]['selections']))
             elif type_ in ('Many2One', 'One2One', 'One2Many', 'Many2Many'):
                 many = False if type_ in ('Many2One', 'One2One') else True
-                remote_model = fields_description[field]['model']
-                RemoteModel = Model.registry.get(remote_model)
-
-                sch = type(
-                    'Model.Schema.' + remote_model,
-                    (SchemaWrapper,),
-                    {'model': remote_model}
-                )
+                sch, pks = get_remote_wrapper(
+                    Model.registry, fields_description[field]['model'])
+                fields[field] = Nested(sch, many=many, only=pks)
 
-                fields[field] = Nested(
-                    sch, many=many, only=RemoteModel.get_primary_keys())
-
-        return fields
+        column_names = {
+            format_fields(x.key): x.columns[0].name
+            for x in Model.__mapper__.iterate_properties
+            if hasattr(x, 'columns')
+        }
+        return {x: (y, column_names.get(x)) for x, y in fields.items()}
 
     def _add_column_kwargs(self, kwargs, column):
         super(ModelConverter, self)._add_column_kwargs(kwargs, column)
-        required_fields = self.schema_cls.Meta.required_fields
-        if (
-            (isinstance(required_fields, (tuple, list)) and
-             column.name in required_fields) or
-            required_fields is True
-        ):
-            kwargs['required'] = True
-            kwargs['allow_none'] = False
-
         if isinstance(column.type, sau.phone_number.PhoneNumberType):
             kwargs['region'] = column.type.region
         elif isinstance(column.type, anyblok.column.CountryType):
-            import pycountry
-            choices = [x.alpha_3 for x in pycountry.countries]
-            labels = [x.name for x in pycountry.countries]
             validators = kwargs.get('validate', [])
-            validators.append(validate.OneOf(choices, labels=labels))
+            validators.append(get_country_validator())
+
+
+class InstanceFieldSchema:
+    """Check the ``InstanceField`` of a load with many=True by batch
+
+    Before the deserialization, all the values of each (model, key) of the
+    ``InstanceField`` are checked with one query by chunk of
+    ``instance_field_batch_size`` values. The fields use this result in
+    place of one query by record::
+
+        class MySchema(InstanceFieldSchema, Schema):
+            code = InstanceField(model='Model.Records', key='code')
+
+        MySchema(context={'registry': registry}).load(data, many=True)
+    """
+    instance_field_batch_size = 1000
+
+    @pre_load(pass_many=True)
+    def prefetch_instance_fields(self, data, many=None, partial=None):
+        self.context.pop('instance_fields', None)
+        registry = self.context.get('registry')
+        if not many or registry is None or not isinstance(data, list):
+            return data
+
+        fields = {}
+        values = {}
+        for name, field in self.load_fields.items():
+            if not isinstance(field, InstanceField):
+                continue
 
+            data_key = field.data_key if field.data_key is not None else name
+            fields[(field.model, field.key)] = field
+            entries = values.setdefault((field.model, field.key), set())
+            for entry in data:
+                value = self.get_instance_field_value(field, entry, data_key)
+                if isinstance(field.container, List):
+                    entries.update(x for x in value or [] if x)
+                elif value:
+                    entries.add(value)
 
-class TemplateSchema:
+        if values:
+            self.context['instance_fields'] = self.query_instance_fields(
+                registry, fields, values)
+
+        return data
+
+    def get_instance_field_value(self, field, entry, data_key):
+        if not isinstance(entry, dict) or data_key not in entry:
+            return None
+
+        try:
+            return field.container.deserialize(entry[data_key])
+        except (ValidationError, TypeError):
+            # the error will be raised by the field during the load
+            return None
+
+    def query_instance_fields(self, registry, fields, values):
+        """Count the records which match with the values
+
+        :param registry: AnyBlok registry
+        :param fields: dict {(model, key): InstanceField}
+        :param values: dict {(model, key): set of values}
+        :rtype: dict {(model, key): (set of values, dict {value: count})}
+        """
+        res = {}
+        for (model, key), entries in values.items():
+            counts = fields[(model, key)].count_records(
+                registry.get(model), list(entries),
+                size=self.instance_field_batch_size)
+            res[(model, key)] = (entries, counts)
+
+        return res
+
+
+class TemplateSchema(InstanceFieldSchema):
     """Base class of Schema generated by ``SchemaWrapper``"""
     OPTIONS_CLASS = MSO
 
+    def _has_processors(self, tag):
+        # marshmallow memoizes it with a process wide lru_cache by schema
+        # instance, which keeps the last schemas and their registry alive
+        return bool(self._hooks[(tag, True)] or self._hooks[(tag, False)])
+
     @validates_schema(pass_original=True, skip_on_field_errors=False)
     def check_unknown_fields(self, data, original_data, partial=None,
                              many=None):
         # TODO partial, Many
+        if not isinstance(original_data, dict):
+            # the type of the data is already an error of the load
+            return
+
         od = set(original_data.keys())
         unknown = od - set(self.fields)
         if unknown:
@@ -177,8 +364,19 @@ class TemplateSchema:
 
 
 class PostLoadSchema:
-    """Return the AnyBlok instance from marshmallow deserialize"""
+    """Return the AnyBlok instance from marshmallow deserialize
+
+    * **post_load_attributes**: True to get the instance by the primary
+      keys, or the list of the fields to filter the instance
+    * **post_load_batch_size**: if defined, the instances of a load with
+      many=True are got with one query by chunk of this size, in place of
+      one query by record
+
+    If an ``InstanceCache`` is given in the context under the key
+    ``instance_cache``, the instances found are saved in it and reused
+    """
     post_load_attributes = True
+    post_load_batch_size = None
 
     def valid_postload(self, postload, data, fields):
         if not postload:
@@ -210,36 +408,192 @@ class PostLoadSchema:
 
         return postload
 
-    def get_instance_from(self, data):
+    def get_cached_instances(self, Model, fields, data, query):
+        """Return the instances found by the query, the result is saved
+        in the ``instance_cache`` of the context if it is given
+
+        :param Model: AnyBlok model
+        :param fields: list of the filtered fields
+        :param data: the loaded data
+        :param query: callable which return the list of the instances
+        """
+        cache = self.context.get('instance_cache')
+        if cache is None:
+            return query()
+
+        values = tuple(data[x] for x in fields)
+        instances = cache.get_instances(Model, fields, values)
+        if instances is None:
+            instances = query()
+            cache.set_instances(Model, fields, values, instances)
+
+        return instances
+
+    def get_postload_fields(self):
+        """Return the fields which filter the instance, None if the
+        instance is not got"""
+        if self.post_load_attributes is True:
+            return self.opts.model.get_primary_keys()
+        elif isinstance(self.post_load_attributes, list):
+            return self.post_load_attributes
+
+        return None
+
+    def query_instances(self, data, fields):
+        """Return the instances which match with the values of the fields
+        of one record"""
+        Model = self.opts.model
         if self.post_load_attributes is True:
-            Model = self.opts.model
-            pks = Model.get_primary_keys()
-            _pks = {x: data[x] for x in pks}
-            return self.valid_postload(
-                Model.from_primary_keys(**_pks), data, pks)
-
-        if isinstance(self.post_load_attributes, list):
-            Model = self.opts.model
-            query = Model.query()
-            filter_by = {}
-            for field in self.post_load_attributes:
-                if field not in data:
-                    raise ValidationError(
-                        {
-                            "KeyError": "%r is unknow in the data" % field,
-                        },
-                        fields_name=[field],
-                        data=data
-                    )
-
-                filter_by[field] = data[field]
-
-            query = query.filter_by(**filter_by)
-            return self.valid_postload(
-                query.all(), data, self.post_load_attributes)
+            _pks = {x: data[x] for x in fields}
+
+            def query():
+                instance = Model.from_primary_keys(**_pks)
+                return [instance] if instance else []
+
+            return self.get_cached_instances(Model, fields, data, query)
+
+        self.get_postload_key(data, fields)
+        query = Model.query().filter_by(**{x: data[x] for x in fields})
+        return self.get_cached_instances(Model, fields, data, query.all)
+
+    def get_prefetched_instances(self, data, fields):
+        """Return the instances got by ``prefetch_instances`` for the
+        record, None if they are unknown"""
+        prefetched = self.context.get('post_load_instances')
+        if (
+            prefetched is None or
+            prefetched[0] is not self.opts.model or
+            prefetched[1] != tuple(fields) or
+            not all(x in data for x in fields)
+        ):
+            return None
+
+        return prefetched[2].get(tuple(data[x] for x in fields))
+
+    def get_instance_from(self, data):
+        fields = self.get_postload_fields()
+        if fields is None:
+            return data
+
+        instances = self.get_prefetched_instances(data, fields)
+        if instances is None:
+            instances = self.query_instances(data, fields)
+
+        return self.valid_postload(instances, data, fields)
 
+    @post_load(pass_many=True)
+    def prefetch_instances(self, data, many=None, partial=None):
+        """Get the instances of a load with many=True by batch
+
+        The instances found are saved in the context, marshmallow calls
+        this processor before the post load of each record, so the
+        instances are only checked by ``make_instance``, after the other
+        post load processors. The records not found by the batch are
+        queried one by one
+        """
+        self.context.pop('post_load_instances', None)
+        fields = self.get_postload_fields()
+        if (
+            not many or not self.post_load_batch_size or fields is None or
+            not isinstance(data, list)
+        ):
+            return data
+
+        Model = self.opts.model
+        self.context['post_load_instances'] = (
+            Model, tuple(fields), self.get_instances_by(Model, fields, data))
         return data
 
+    def _do_load(self, *args, **kwargs):
+        try:
+            return super(PostLoadSchema, self)._do_load(*args, **kwargs)
+        finally:
+            # the schema can be cached, it must not keep the instances
+            self.context.pop('post_load_instances', None)
+
+    def get_postload_key(self, data, fields):
+        """Return the tuple of the values used to find the instance
+
+        If a field is missing, the data is kept as it for the primary keys,
+        and an error is raised for ``post_load_attributes``
+        """
+        for field in fields:
+            if field not in data:
+                if self.post_load_attributes is True:
+                    return None
+
+                raise ValidationError(
+                    {
+                        "KeyError": "%r is unknow in the data" % field,
+                    },
+                    fields_name=[field],
+                    data=data
+                )
+
+        return tuple(data[x] for x in fields)
+
+    def get_instances_by(self, Model, fields, data):
+        """Return the instances which match with the values of the fields
+
+        The query is done by chunk of ``post_load_batch_size`` values, only
+        if all the fields are columns. The values which are not found are
+        not in the result, they must be checked record by record
+
+        :param Model: AnyBlok model to query
+        :param fields: list of the fields to filter
+        :param data: list of the loaded data
+        :rtype: dict {tuple of the values: [instances]}
+        """
+        keys = {
+            tuple(entry[x] for x in fields)
+            for entry in data
+            if all(x in entry for x in fields)
+        }
+        instances = {}
+        cache = self.context.get('instance_cache')
+        if cache is not None:
+            for key in keys:
+                cached = cache.get_instances(Model, fields, key)
+                if cached is not None:
+                    instances[key] = cached
+
+        keys = [x for x in keys if x not in instances]
+        columns = [get_mapped_column(Model, x) for x in fields]
+        if not keys or any(x is None for x in columns):
+            return instances
+
+        if len(fields) == 1:
+            column = columns[0]
+            values = [x[0] for x in keys]
+        else:
+            column = sa.tuple_(*columns)
+            values = keys
+
+        found = {}
+        size = self.post_load_batch_size
+        for i in range(0, len(values), size):
+            query = Model.query().filter(column.in_(values[i:i + size]))
+            for instance in query.all():
+                key = tuple(getattr(instance, x) for x in fields)
+                found.setdefault(key, []).append(instance)
+
+        if cache is not None:
+            for key, value in found.items():
+                cache.set_instances(Model, fields, key, value)
+
+        instances.update(found)
+        return instances
+
+
+SchemaOptions = namedtuple(
+    'SchemaOptions',
+    ['registry', 'model', 'only_primary_key', 'required_fields', 'instances',
+     'compiled_dump', 'compiled_load', 'render'])
+LOAD_OPTIONS = ('registry', 'model', 'only_primary_key', 'required_fields',
+                'instances', 'compiled_load', 'render')
+DUMP_OPTIONS = ('registry', 'model', 'only_primary_key', 'instances',
+                'compiled_dump', 'render')
+
 
 class SchemaWrapper(SchemaABC):
     """Schema Wrapper to generate marshmallow schema
@@ -263,18 +617,38 @@ class SchemaWrapper(SchemaABC):
     * registry: the anyblok registry, only if you know it
     * only_primary_key: boolean, if True the marshmallow parameter only
       will be filled with the name of the primary keys.
+    * schema_cache: the ``SchemaCache`` where the generated schema classes
+      are saved, by default the process wide cache
+    * compiled_dump: boolean, if True ``dump`` and ``dumps`` use a function
+      generated for the fields of the schema instead of the loop of
+      marshmallow, the result is the same
+    * compiled_load: boolean, if True ``load``, ``loads`` and ``validate``
+      deserialize the fields with a function generated for the schema, the
+      result and the errors are the same
+    * render: the render used by ``dumps`` and ``loads`` in place of the
+      ``render_module`` of the schema, name of a render of
+      ``anyblok_marshmallow.render.renders`` ('json', 'orjson') or object
+      with the methods ``dumps`` and ``loads``. By default the render
+      defined by ``set_default_render``
 
     .. note::
 
         The model and registry are required to generate the schema. they can be
         defined by class attribute, parameter in the methods (load, loads,
         validate, dump, dumps) or in the context attribute.
+
+    The parameters of the methods are only used by the call, the same
+    wrapper can be shared by many threads.
     """
 
     model = None
     required_fields = None
     registry = None
     only_primary_key = None
+    compiled_dump = False
+    compiled_load = False
+    render = None
+    schema_cache = schema_cache
 
     class Schema:
         pass
@@ -285,36 +659,85 @@ class SchemaWrapper(SchemaABC):
         self.only_primary_key = kwargs.pop(
             'only_primary_key', self.only_primary_key)
         self.model = kwargs.pop('model', self.model)
+        self.compiled_dump = kwargs.pop('compiled_dump', self.compiled_dump)
+        self.compiled_load = kwargs.pop('compiled_load', self.compiled_load)
+        self.render = kwargs.pop('render', self.render)
 
         self.required_fields = kwargs.pop(
             'required_fields', self.required_fields)
         self.instances = kwargs.pop('instances', {})
         self.args = args
         self.kwargs = kwargs
+        self.local = local()
 
-    @lru_cache()
-    def generate_marsmallow_instance(self, registry, model, only_primary_key,
-                                     *required_fields):
-        """Generate the real mashmallow-sqlalchemy schema"""
-        if len(required_fields) == 1 and required_fields[0] is True:
-            required_fields = True
+    def __deepcopy__(self, memo):
+        """Copy the wrapper without the generated schemas"""
+        wrapper = self.__class__.__new__(self.__class__)
+        memo[id(self)] = wrapper
+        for key, value in self.__dict__.items():
+            if key != 'local':
+                setattr(wrapper, key, deepcopy(value, memo))
 
+        wrapper.local = local()
+        return wrapper
+
+    @property
+    def schemas(self):
+        """Generated schema instances of the current thread"""
+        try:
+            return self.local.schemas
+        except AttributeError:
+            self.local.schemas = {}
+            return self.local.schemas
+
+    def release_closed_registries(self):
+        """Forget the schemas of the current thread generated for the closed
+        registries, they keep their registry in their context
+
+        Called before a new schema is generated
+        """
+        schemas = self.schemas
+        for key in [x for x in schemas if is_closed_registry(x[0]())]:
+            del schemas[key]
+
+    def generate_marsmallow_class(self, registry, model, required_fields):
+        """Return the real mashmallow-sqlalchemy schema class
+
+        The class is generated once and saved in the ``schema_cache``,
+        the wrappers with the same options share it. If many threads
+        want the same missing class, only one thread generates it
+        """
         cls_name = 'Model.Schema.%s' % model
         if registry is None:
             raise RegistryNotFound(
                 'No registry found for create schema %r' % cls_name)
 
-        Schema = type(
+        Model = registry.get(model)
+        key = (registry, model, required_fields, self.Schema)
+        return self.schema_cache.get_or_build(
+            key,
+            lambda: self.build_marsmallow_class(
+                registry, Model, cls_name, required_fields),
+            lambda Schema: Schema.opts.model is Model)
+
+    def build_marsmallow_class(self, registry, Model, cls_name,
+                               required_fields):
+        """Generate the real mashmallow-sqlalchemy schema class"""
+        if required_fields == (True,):
+            required_fields = True
+
+        return type(
             cls_name, (TemplateSchema, self.Schema, MS),
             {
                 'Meta': type(
                     'Meta',
                     tuple(),
                     {
-                        'model': registry.get(model),
+                        'model': Model,
                         'sqla_session': registry.Session,
                         'model_converter': ModelConverter,
                         'required_fields': required_fields,
+                        'register': False,
                     },
                 ),
                 'TYPE_MAPPING': {
@@ -336,18 +759,33 @@ class SchemaWrapper(SchemaABC):
             }
         )
 
-        kwargs = self.kwargs.copy()
-
-        if only_primary_key:
-            Model = registry.get(model)
-            pks = Model.get_primary_keys()
-            kwargs['only'] = pks
+    def generate_marsmallow_instance(self, registry, model, only_primary_key,
+                                     *required_fields, instances=None,
+                                     compiled_load=False):
+        """Generate the real mashmallow-sqlalchemy schema
+
+        The schema instances are saved by thread, the context of a schema
+        is only changed by the calls of its thread
+        """
+        Schema = self.generate_marsmallow_class(
+            registry, model, required_fields)
+        key = (ref(registry), Schema, only_primary_key, bool(compiled_load))
+        schema = self.schemas.get(key)
+        if schema is None:
+            self.release_closed_registries()
+            kwargs = self.kwargs.copy()
+
+            if only_primary_key:
+                kwargs['only'] = Schema.opts.model.get_primary_keys()
+
+            schema = self.schemas[key] = Schema(*self.args, **kwargs)
+            if compiled_load:
+                compiler.install_load(schema)
 
-        schema = Schema(*self.args, **kwargs)
         schema.context.update(self.context)
         schema.context['registry'] = registry
-        schema.context['instances'] = self.instances
-
+        schema.context['instances'] = (
+            self.instances if instances is None else instances)
         return schema
 
     @property
@@ -365,49 +803,266 @@ class SchemaWrapper(SchemaABC):
     @property
     def schema(self):
         """property to get the real schema"""
-        registry = self.context.get('registry', self.registry)
-        required_fields = self.context.get(
-            'required_fields', self.required_fields)
-        model = self.context.get('model', self.model)
-        only_primary_key = self.context.get(
-            'only_primary_key', self.only_primary_key)
+        return self.get_schema(self.get_options())
+
+    def get_options(self, kwargs=None, entries=LOAD_OPTIONS):
+        """Return the options of one call
+
+        The options given by the kwargs of the call are popped from them,
+        the wrapper is not modified, so one wrapper can be called by
+        many threads at the same time
+
+        :param kwargs: dict of the kwargs of the call
+        :param entries: names of the options allowed in the kwargs
+        :rtype: SchemaOptions
+        """
+        if kwargs is None:
+            kwargs = {}
 
+        options = {}
+        for entry in SchemaOptions._fields:
+            value = getattr(self, entry)
+            if entry in entries and entry in kwargs:
+                value = kwargs.pop(entry)
+
+            if entry != 'instances':
+                value = self.context.get(entry, value)
+
+            options[entry] = value
+
+        required_fields = options['required_fields']
         if required_fields is None:
             required_fields = []
         if required_fields is True:
             required_fields = [True]
 
+        options['required_fields'] = tuple(required_fields)
+        return SchemaOptions(**options)
+
+    def get_schema(self, options):
+        """Return the real schema for the options of one call"""
         return self.generate_marsmallow_instance(
-            registry, model, only_primary_key, *required_fields
+            options.registry, options.model, options.only_primary_key,
+            *options.required_fields, instances=options.instances,
+            compiled_load=options.compiled_load
         )
 
-    @update_from_kwargs('registry', 'only_primary_key', 'model', 'instances',
-                        'required_fields')
-    def loads(self, *args, **kwargs):
+    def get_render_module(self, schema, options):
+        """Return the render of the call, by default the ``render_module``
+        of the real schema"""
+        return get_render(options.render) or schema.opts.render_module
+
+    def loads(self, json_data, *, many=None, partial=None, unknown=None,
+              **kwargs):
         """overload the main method to call in it in the real schema"""
-        return self.schema.loads(*args, **kwargs)
+        options = self.get_options(kwargs)
+        schema = self.get_schema(options)
+        data = self.get_render_module(schema, options).loads(
+            json_data, **kwargs)
+        return schema.load(data, many=many, partial=partial, unknown=unknown)
 
-    @update_from_kwargs('registry', 'only_primary_key', 'model', 'instances',
-                        'required_fields')
     def load(self, *args, **kwargs):
         """overload the main method to call in it in the real schema"""
-        return self.schema.load(*args, **kwargs)
-
-    @update_from_kwargs('registry', 'only_primary_key', 'model', 'instances')
-    def dumps(self, *args, **kwargs):
+        schema = self.get_schema(self.get_options(kwargs))
+        return schema.load(*args, **kwargs)
+
+    def loads_iter(self, lines, batch_size=100, **kwargs):
+        """Return a generator which loads the documents of a NDJSON file
+
+        The lines are read one by one and the documents are loaded by
+        batch of ``batch_size`` with ``many=True``, so the batched post
+        load and ``InstanceField`` checks are used. The generator yields
+        the tuple (line number, instance) or (line number, ValidationError)
+        if the document is not valid::
+
+            with open('customers.ndjson') as f:
+                for number, res in customer_schema.loads_iter(f):
+                    if isinstance(res, ValidationError):
+                        print(number, res.messages)
+
+        :param lines: file like or iterable of the lines
+        :param batch_size: number of documents loaded together
+        """
+        options = self.get_options(kwargs)
+        schema = self.get_schema(options)
+        return stream.loads_iter(
+            schema, lines, batch_size=batch_size,
+            render_module=self.get_render_module(schema, options), **kwargs)
+
+    def serialize(self, schema, options, obj, many=None):
+        """Dump the object with the real schema, with the compiled dump
+        if the option is set"""
+        if options.compiled_dump:
+            return compiler.dump(schema, obj, many=many)
+
+        return schema.dump(obj, many=many)
+
+    def dumps(self, obj, *args, many=None, **kwargs):
         """overload the main method to call in it in the real schema"""
-        return self.schema.dumps(*args, **kwargs)
+        options = self.get_options(kwargs, DUMP_OPTIONS)
+        schema = self.get_schema(options)
+        return self.get_render_module(schema, options).dumps(
+            self.serialize(schema, options, obj, many=many), *args, **kwargs)
+
+    def dumpb(self, obj, *args, many=None, **kwargs):
+        """Dump the object in MessagePack, the result is bytes
+
+        The UUID, Decimal, datetime, PhoneNumber, Country and Color values
+        which stay in the dump are saved as MessagePack extension types.
+        ``msgpack`` must be installed::
+
+            payload = customer_schema.dumpb(customers, many=True)
+            customers = customer_schema.loadb(payload, many=True)
+        """
+        options = self.get_options(kwargs, DUMP_OPTIONS)
+        schema = self.get_schema(options)
+        return get_render('msgpack').dumps(
+            self.serialize(schema, options, obj, many=many), *args, **kwargs)
+
+    def loadb(self, data, *, many=None, partial=None, unknown=None,
+              **kwargs):
+        """Load the MessagePack data given by ``dumpb``, with the same
+        validation as ``load``"""
+        options = self.get_options(kwargs)
+        schema = self.get_schema(options)
+        data = get_render('msgpack').loads(data, **kwargs)
+        return schema.load(data, many=many, partial=partial, unknown=unknown)
 
-    @update_from_kwargs('registry', 'only_primary_key', 'model', 'instances')
     def dump(self, *args, **kwargs):
         """overload the main method to call in it in the real schema"""
-        return self.schema.dump(*args, **kwargs)
+        options = self.get_options(kwargs, DUMP_OPTIONS)
+        schema = self.get_schema(options)
+        if options.compiled_dump:
+            return compiler.dump(schema, *args, **kwargs)
+
+        return schema.dump(*args, **kwargs)
+
+    def dump_iter(self, iterable, yield_per=None, **kwargs):
+        """Return a generator of the dump of the items, as
+        ``dump(iterable, many=True)`` without keep the whole result in
+        memory
+
+        ::
+
+            query = registry.Customer.query()
+            for data in customer_schema.dump_iter(query, yield_per=1000):
+                ...
+
+        :param iterable: items to dump, AnyBlok query or any iterable
+        :param yield_per: if given, the query fetches the rows by batch of
+                          this size with ``Query.yield_per``
+        """
+        options = self.get_options(kwargs, DUMP_OPTIONS)
+        schema = self.get_schema(options)
+        if yield_per is not None:
+            iterable = iterable.yield_per(yield_per)
+
+        return compiler.dump_iter(
+            schema, iterable, compiled=options.compiled_dump)
+
+    def dumps_iter(self, iterable, *args, yield_per=None, ndjson=False,
+                   **kwargs):
+        """Return a generator of the chunks of the JSON array of the dump
+        of the items, or of the lines of NDJSON if ``ndjson`` is True
+
+        ::
+
+            with open('customers.json', 'w') as f:
+                f.writelines(customer_schema.dumps_iter(query))
+
+        The other args and kwargs are given to the render module
+        """
+        options = self.get_options(kwargs, DUMP_OPTIONS)
+        schema = self.get_schema(options)
+        if yield_per is not None:
+            iterable = iterable.yield_per(yield_per)
+
+        serialized = compiler.dump_iter(
+            schema, iterable, compiled=options.compiled_dump)
+        return compiler.render_iter(
+            self.get_render_module(schema, options), serialized, *args,
+            ndjson=ndjson, **kwargs)
+
+    def dump_columnar(self, iterable, batch_size=10000, yield_per=None,
+                      **kwargs):
+        """Return the Arrow table of the dump of the items
+
+        The types of the columns are given by the fields of the schema,
+        the ``Nested`` fields become struct or list of struct. The items
+        are dumped by batch of ``batch_size``. ``pyarrow`` must be
+        installed::
+
+            table = customer_schema.dump_columnar(registry.Customer.query())
+
+        :param iterable: items to dump, AnyBlok query or any iterable
+        :param batch_size: number of items dumped together
+        :param yield_per: if given, the query fetches the rows by batch of
+                          this size with ``Query.yield_per``
+        """
+        schema, dump, iterable = self.get_columnar_dump(
+            iterable, yield_per, kwargs)
+        return columnar.dump_table(
+            schema, dump, iterable, batch_size=batch_size)
+
+    def dump_parquet(self, iterable, where, batch_size=10000, yield_per=None,
+                     **kwargs):
+        """Write the dump of the items in a Parquet file, the Arrow
+        batches are written one by one so the whole table is never in
+        memory
+
+        :param where: path or file like of the Parquet file
+        :rtype: int, number of rows written
+        """
+        schema, dump, iterable = self.get_columnar_dump(
+            iterable, yield_per, kwargs)
+        return columnar.dump_parquet(
+            schema, dump, iterable, where, batch_size=batch_size, **kwargs)
+
+    def get_columnar_dump(self, iterable, yield_per, kwargs):
+        """Return the real schema, the function which dumps a batch of
+        items and the iterable to dump"""
+        options = self.get_options(kwargs, DUMP_OPTIONS)
+        schema = self.get_schema(options)
+        if yield_per is not None:
+            iterable = iterable.yield_per(yield_per)
+
+        def dump(batch):
+            return self.serialize(schema, options, batch, many=True)
+
+        return schema, dump, iterable
+
+    def dump_query(self, query, **kwargs):
+        """Dump the result of the query, as ``dump(query, many=True)``
+
+        The columns of the fields are selected and the rows are dumped
+        without build the ORM instances. If the schema has some fields
+        which are not column (Nested, Function, ...) the instances are
+        dumped by the compiled dump, the nested relationships are
+        loaded by the options of ``optimize_query``
+
+        :param query: AnyBlok query on the model of the schema
+        """
+        schema = self.get_schema(self.get_options(kwargs, DUMP_OPTIONS))
+        return dump_query(schema, query)
+
+    def optimize_query(self, query, **kwargs):
+        """Return the query with the loader options of the relationships
+        dumped by the schema and its nested schemas
+
+        ::
+
+            query = customer_schema.optimize_query(registry.Customer.query())
+            customer_schema.dump(query, many=True)
+
+        :param query: AnyBlok query on the model of the schema
+        """
+        schema = self.get_schema(self.get_options(kwargs, DUMP_OPTIONS))
+        return optimize_query(schema, query)
 
-    @update_from_kwargs('registry', 'only_primary_key', 'model', 'instances',
-                        'required_fields')
     def validate(self, *args, **kwargs):
         """overload the main method to call in it in the real schema"""
-        return self.schema.validate(*args, **kwargs)
+        schema = self.get_schema(self.get_options(kwargs))
+        return schema.validate(*args, **kwargs)
 
     def _update_fields(self, *args, **kwargs):
         return self.schema._update_fields(*args, **kwargs)
@@ -0,0 +1,100 @@
+# This file is a part of the AnyBlok / Marshmallow api project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from marshmallow.exceptions import ValidationError, SCHEMA
+
+
+def parse_lines(render_module, lines):
+    """Yield (line number, data) for each line which is not blank
+
+    If the line is not a valid document, the data is the
+    ``ValidationError``
+    """
+    loads = render_module.loads
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            yield number, loads(line)
+        except ValueError as error:
+            yield number, ValidationError(
+                {SCHEMA: ['Invalid document: %s' % error]}, data=line)
+
+
+def load_one_by_one(schema, records, **kwargs):
+    """Load each record alone, return the list of (line number, instance
+    or ``ValidationError``)"""
+    res = []
+    for number, data in records:
+        try:
+            res.append((number, schema.load(data, many=False, **kwargs)))
+        except ValidationError as error:
+            res.append((number, error))
+
+    return res
+
+
+def load_batch(schema, records, **kwargs):
+    """Load the records with ``many=True``
+
+    The records in error are removed from the batch and the others are
+    loaded again, so the batched post load and ``InstanceField`` are kept.
+    If the errors are not given by index, the records are loaded one by one
+
+    :param records: list of (line number, data or ``ValidationError``)
+    :rtype: list of (line number, instance or ``ValidationError``)
+    """
+    res = [x for x in records if isinstance(x[1], ValidationError)]
+    records = [x for x in records if not isinstance(x[1], ValidationError)]
+    while records:
+        try:
+            loaded = schema.load([x[1] for x in records], many=True, **kwargs)
+        except ValidationError as error:
+            messages = error.messages
+            if not isinstance(messages, dict) or not all(
+                isinstance(x, int) and 0 <= x < len(records)
+                for x in messages
+            ):
+                res.extend(load_one_by_one(schema, records, **kwargs))
+                break
+
+            res.extend(
+                (records[x][0], ValidationError(
+                    messages[x], data=records[x][1]))
+                for x in messages)
+            records = [x for i, x in enumerate(records) if i not in messages]
+            continue
+
+        res.extend((x[0], y) for x, y in zip(records, loaded))
+        break
+
+    res.sort(key=lambda x: x[0])
+    return res
+
+
+def loads_iter(schema, lines, batch_size=100, render_module=None,
+               **kwargs):
+    """Yield (line number, instance or ``ValidationError``) for each
+    document of the lines
+
+    The lines are read one by one and loaded by batch of ``batch_size``
+    documents, only one batch is kept in memory. The documents are parsed
+    by the ``render_module`` of the schema if no render module is given
+    """
+    if render_module is None:
+        render_module = schema.opts.render_module
+
+    batch = []
+    for record in parse_lines(render_module, lines):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield from load_batch(schema, batch, **kwargs)
+            batch = []
+
+    if batch:
+        yield from load_batch(schema, batch, **kwargs)
@@ -9,6 +9,7 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 import logging
 import pytest
+from sqlalchemy import event
 from . import add_complexe_model, add_simple_model
 from anyblok.tests.conftest import *  # noqa
 from anyblok.tests.conftest import init_registry
@@ -28,3 +29,36 @@ def registry_simple_model(request, bloks_loaded):
     registry = init_registry(add_simple_model)
     request.addfinalizer(registry.close)
     return registry
+
+
+@pytest.fixture
+def capture_statements(request):
+    """Return the function which saves the SQL statements executed by the
+    engine of a registry until the end of the test::
+
+        statements = capture_statements(registry, startswith='SELECT')
+
+    :param registry: AnyBlok registry
+    :param startswith: save only the statements which start with it
+    :param contains: save only the statements which contain it
+    :rtype: list of the saved statements
+    """
+
+    def capture(registry, startswith=None, contains=None):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if startswith is not None and not statement.startswith(startswith):
+                return
+            elif contains is not None and contains not in statement:
+                return
+
+            statements.append(statement)
+
+        engine = registry.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        request.addfinalizer(lambda: event.remove(
+            engine, 'before_cursor_execute', before_cursor_execute))
+        return statements
+
+    return capture
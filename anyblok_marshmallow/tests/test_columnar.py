@@ -0,0 +1,211 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import datetime as dt
+import decimal
+import uuid
+import pytest
+from marshmallow import Schema, fields
+from . import CustomerSchema
+from anyblok_marshmallow import columnar
+
+pa = pytest.importorskip('pyarrow')
+
+
+class TypesSchema(Schema):
+    id = fields.Integer()
+    name = fields.String()
+    active = fields.Boolean()
+    rate = fields.Float()
+    price = fields.Decimal(places=2)
+    amount = fields.Decimal()
+    uuid = fields.UUID()
+    create_date = fields.DateTime()
+    day = fields.Date()
+    hour = fields.Time()
+    duration = fields.TimeDelta()
+    other = fields.Raw()
+    tags = fields.List(fields.String())
+
+
+class TestColumnarTypes:
+
+    def get_objects(self, nb):
+        return [
+            {
+                'id': i,
+                'name': 'name %d' % i,
+                'active': bool(i % 2),
+                'rate': i / 2,
+                'price': decimal.Decimal('1.25'),
+                'amount': decimal.Decimal('1.5'),
+                'uuid': uuid.UUID(int=i),
+                'create_date': dt.datetime(2019, 1, 2, 3, 4, 5),
+                'day': dt.date(2019, 1, 2),
+                'hour': dt.time(3, 4, 5),
+                'duration': dt.timedelta(seconds=i),
+                'other': {'value': i},
+                'tags': ['a', 'b'],
+            }
+            for i in range(nb)
+        ]
+
+    def dump_table(self, objects, batch_size=10000):
+        schema = TypesSchema()
+        return columnar.dump_table(
+            schema, lambda batch: schema.dump(batch, many=True), objects,
+            batch_size=batch_size)
+
+    def test_types(self):
+        table = self.dump_table(self.get_objects(3))
+        types = {x.name: x.type for x in table.schema}
+        assert types == {
+            'id': pa.int64(),
+            'name': pa.string(),
+            'active': pa.bool_(),
+            'rate': pa.float64(),
+            'price': pa.decimal128(38, 2),
+            'amount': pa.string(),
+            'uuid': pa.string(),
+            'create_date': pa.timestamp('us'),
+            'day': pa.date32(),
+            'hour': pa.time64('us'),
+            'duration': pa.int64(),
+            'other': pa.string(),
+            'tags': pa.list_(pa.string()),
+        }
+
+    def test_values(self):
+        table = self.dump_table(self.get_objects(3))
+        row = table.to_pylist()[1]
+        assert row == {
+            'id': 1,
+            'name': 'name 1',
+            'active': True,
+            'rate': 0.5,
+            'price': decimal.Decimal('1.25'),
+            'amount': '1.5',
+            'uuid': str(uuid.UUID(int=1)),
+            'create_date': dt.datetime(2019, 1, 2, 3, 4, 5),
+            'day': dt.date(2019, 1, 2),
+            'hour': dt.time(3, 4, 5),
+            'duration': 1,
+            'other': '{"value": 1}',
+            'tags': ['a', 'b'],
+        }
+
+    def test_batches(self):
+        dumped = []
+        schema = TypesSchema()
+
+        def dump(batch):
+            dumped.append(len(batch))
+            return schema.dump(batch, many=True)
+
+        table = columnar.dump_table(
+            schema, dump, self.get_objects(10), batch_size=4)
+        assert dumped == [4, 4, 2]
+        assert table.num_rows == 10
+        assert len(table.to_batches()) == 3
+
+    def test_empty(self):
+        table = self.dump_table([])
+        assert table.num_rows == 0
+        assert table.schema.field('id').type == pa.int64()
+        assert table.schema.field('other').type == pa.string()
+
+    def test_first_batch_without_value(self):
+        objects = self.get_objects(4)
+        for entry in objects[:2]:
+            for key in entry:
+                entry[key] = None
+
+        table = self.dump_table(objects, batch_size=2)
+        assert len(table.to_batches()) == 2
+        assert table.schema.field('create_date').type == pa.timestamp('us')
+        assert table.schema.field('tags').type == pa.list_(pa.string())
+        assert table.schema.field('other').type == pa.string()
+        rows = table.to_pylist()
+        assert rows[0]['id'] is None
+        assert rows[0]['other'] is None
+        assert rows[3]['id'] == 3
+        assert rows[3]['other'] == '{"value": 3}'
+
+    def test_number_as_string(self):
+
+        class AsStringSchema(Schema):
+            number = fields.Number(as_string=True)
+            integer = fields.Integer(as_string=True)
+            rate = fields.Float(as_string=True)
+
+        schema = AsStringSchema()
+        table = columnar.dump_table(
+            schema, lambda batch: schema.dump(batch, many=True),
+            [{'number': 1.5, 'integer': 2, 'rate': 0.5}])
+        assert {x.name: x.type for x in table.schema} == {
+            'number': pa.string(),
+            'integer': pa.string(),
+            'rate': pa.string(),
+        }
+        assert table.to_pylist() == [
+            {'number': '1.5', 'integer': '2', 'rate': '0.5'}]
+
+
+class TestDumpColumnar:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_complexe_model):
+        transaction = registry_complexe_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    def add_customers(self, registry, nb):
+        city = registry.City.insert(name="Rouen", zipcode="76000")
+        tag = registry.Tag.insert(name="tag")
+        for i in range(nb):
+            customer = registry.Customer.insert(name="C%d" % i)
+            customer.tags.append(tag)
+            registry.Address.insert(
+                customer=customer, city=city, street="Street %d" % i)
+
+        registry.flush()
+
+    def get_query(self, registry):
+        Customer = registry.Customer
+        return Customer.query().order_by(Customer.id)
+
+    def test_dump_columnar(self, registry_complexe_model):
+        registry = registry_complexe_model
+        self.add_customers(registry, 5)
+        schema = CustomerSchema(registry=registry)
+        query = self.get_query(registry)
+        table = schema.dump_columnar(query, batch_size=2)
+        assert table.num_rows == 5
+        addresses = table.schema.field('addresses').type
+        assert isinstance(addresses, pa.ListType)
+        address = addresses.value_type
+        assert {address[i].name: address[i].type.id
+                for i in range(address.num_fields)} == {
+            'id': pa.int64().id,
+            'street': pa.string().id,
+            'city': pa.struct([]).id,
+        }
+        data = schema.dump(query.all(), many=True)
+        assert sorted(table.to_pylist(), key=lambda x: x['id']) == sorted(
+            [dict(x) for x in data], key=lambda x: x['id'])
+
+    def test_dump_parquet(self, registry_complexe_model, tmpdir):
+        pq = pytest.importorskip('pyarrow.parquet')
+        registry = registry_complexe_model
+        self.add_customers(registry, 5)
+        schema = CustomerSchema(registry=registry)
+        path = str(tmpdir.join('customers.parquet'))
+        nb_rows = schema.dump_parquet(
+            self.get_query(registry), path, batch_size=2, yield_per=2)
+        assert nb_rows == 5
+        table = pq.read_table(path)
+        assert table.num_rows == 5
+        assert table.equals(schema.dump_columnar(self.get_query(registry)))
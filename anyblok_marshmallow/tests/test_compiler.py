@@ -0,0 +1,315 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import pytest
+from marshmallow import Schema, post_dump, validate, EXCLUDE, INCLUDE
+from marshmallow.exceptions import ValidationError
+from marshmallow.fields import Field
+from . import ExempleSchema, CustomerSchema
+from anyblok_marshmallow import SchemaWrapper, fields
+from anyblok_marshmallow.compiler import compile_dump, install_load
+from anyblok_marshmallow.validate import OneOf
+
+
+@pytest.fixture
+def count_serialize(monkeypatch):
+    counter = {'serialize': 0}
+    serialize = Field.serialize
+
+    def wrapper(self, *args, **kwargs):
+        counter['serialize'] += 1
+        return serialize(self, *args, **kwargs)
+
+    monkeypatch.setattr(Field, 'serialize', wrapper)
+    return counter
+
+
+class TestCompiledDumpSimpleModel:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_simple_model):
+        transaction = registry_simple_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    def test_dump(self, registry_simple_model):
+        registry = registry_simple_model
+        exemple = registry.Exemple.insert(name="test", number=1)
+        schema = ExempleSchema(registry=registry)
+        assert (
+            schema.dump(exemple, compiled_dump=True) ==
+            schema.dump(exemple) ==
+            {'id': exemple.id, 'name': 'test', 'number': 1}
+        )
+
+    def test_dump_many(self, registry_simple_model):
+        registry = registry_simple_model
+        exemples = [registry.Exemple.insert(name="test %d" % i)
+                    for i in range(10)]
+        schema = ExempleSchema(registry=registry, compiled_dump=True)
+        assert schema.dump(exemples, many=True) == ExempleSchema(
+            registry=registry).dump(exemples, many=True)
+        query = registry.Exemple.query()
+        assert schema.dump(query, many=True) == ExempleSchema(
+            registry=registry).dump(query, many=True)
+
+    def test_dumps(self, registry_simple_model):
+        registry = registry_simple_model
+        exemple = registry.Exemple.insert(name="test")
+        schema = ExempleSchema(registry=registry)
+        assert (
+            schema.dumps(exemple, compiled_dump=True, sort_keys=True) ==
+            schema.dumps(exemple, sort_keys=True)
+        )
+
+    def test_dump_only_primary_key(self, registry_simple_model):
+        registry = registry_simple_model
+        exemple = registry.Exemple.insert(name="test")
+        schema = ExempleSchema(registry=registry, compiled_dump=True)
+        assert schema.dump(exemple, only_primary_key=True) == {
+            'id': exemple.id}
+
+    def test_dump_dict(self, registry_simple_model):
+        schema = ExempleSchema(
+            registry=registry_simple_model, compiled_dump=True)
+        assert schema.dump({'id': 1, 'name': 'test'}) == {
+            'id': 1, 'name': 'test'}
+
+    def test_dump_without_field_loop(
+        self, registry_simple_model, count_serialize
+    ):
+        registry = registry_simple_model
+        exemples = [registry.Exemple.insert(name="test %d" % i)
+                    for i in range(10)]
+        schema = ExempleSchema(registry=registry)
+        schema.dump(exemples, many=True)
+        assert count_serialize['serialize'] == 30
+        count_serialize['serialize'] = 0
+        schema.dump(exemples, many=True, compiled_dump=True)
+        assert count_serialize['serialize'] == 0
+
+    def test_custom_fields(self, registry_simple_model):
+        registry = registry_simple_model
+
+        class MySchema(ExempleSchema):
+
+            class Schema:
+                label = fields.Function(lambda obj: 'label %s' % obj.name)
+                name = fields.String(data_key='title', attribute='name')
+                other = fields.Integer(default=lambda: 3)
+
+        exemple = registry.Exemple.insert(name="test")
+        schema = MySchema(registry=registry)
+        assert (
+            schema.dump(exemple, compiled_dump=True) ==
+            schema.dump(exemple) ==
+            {'id': exemple.id, 'title': 'test', 'number': None,
+             'label': 'label test', 'other': 3}
+        )
+
+    def test_not_compiled_with_dump_processor(self, registry_simple_model):
+        registry = registry_simple_model
+
+        class MySchema(ExempleSchema):
+
+            class Schema:
+
+                @post_dump
+                def add_label(self, data, **kwargs):
+                    data['label'] = 'label'
+                    return data
+
+        exemple = registry.Exemple.insert(name="test")
+        schema = MySchema(registry=registry)
+        assert compile_dump(schema.schema) is None
+        assert schema.dump(exemple, compiled_dump=True) == schema.dump(
+            exemple)
+
+
+class TestCompiledDumpComplexeModel:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_complexe_model):
+        transaction = registry_complexe_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    def add_customers(self, registry):
+        city = registry.City.insert(name="Rouen", zipcode="76000")
+        tag = registry.Tag.insert(name="tag 1")
+        customers = []
+        for i in range(5):
+            customer = registry.Customer.insert(name="C%d" % i)
+            customer.tags.append(tag)
+            registry.Address.insert(
+                customer=customer, city=city, street="Street %d" % i)
+            customers.append(customer)
+
+        return customers
+
+    def test_dump_nested(self, registry_complexe_model):
+        registry = registry_complexe_model
+        customers = self.add_customers(registry)
+        schema = CustomerSchema(registry=registry)
+        assert schema.dump(customers, many=True, compiled_dump=True) == (
+            schema.dump(customers, many=True))
+
+    def test_dump_nested_without_field_loop(
+        self, registry_complexe_model, count_serialize
+    ):
+        registry = registry_complexe_model
+        customers = self.add_customers(registry)
+        schema = CustomerSchema(registry=registry)
+        schema.dump(customers, many=True, compiled_dump=True)
+        assert count_serialize['serialize'] == 0
+
+    def test_dump_generated_relationship(self, registry_complexe_model):
+        registry = registry_complexe_model
+        customers = self.add_customers(registry)
+        schema = SchemaWrapper(registry=registry, model='Model.Address')
+        addresses = registry.Address.query().all()
+        assert addresses
+        assert len(customers) == len(addresses)
+        assert schema.dump(addresses, many=True, compiled_dump=True) == (
+            schema.dump(addresses, many=True))
+
+
+class FlatSchema(Schema):
+    name = fields.String(required=True)
+    code = fields.String(validate=validate.Length(max=3))
+    state = fields.String(validate=OneOf(['draft', 'done']))
+    number = fields.Integer()
+    strict = fields.Integer(strict=True, allow_none=True)
+    active = fields.Boolean()
+    price = fields.Float()
+    raw = fields.Raw()
+    choice = fields.Raw(validate=OneOf(['x', 'y']))
+    title = fields.String(data_key='label')
+    nested = fields.String(attribute='sub.value')
+    default = fields.Integer(missing=lambda: 10)
+
+
+class TestCompiledLoad:
+
+    def load(self, data, **kwargs):
+        results = []
+        for schema in (FlatSchema(), install_load(FlatSchema())):
+            try:
+                results.append(('ok', schema.load(data, **kwargs)))
+            except ValidationError as e:
+                results.append(('ko', e.messages, e.valid_data))
+
+        assert results[0] == results[1]
+        return results[1]
+
+    def test_compiled(self):
+        schema = install_load(FlatSchema())
+        assert schema._deserialize.__name__ == 'deserialize'
+
+    @pytest.mark.parametrize('data', [
+        {'name': 'test'},
+        {'name': 'test', 'code': 'abc', 'state': 'draft', 'number': 1,
+         'strict': None, 'active': True, 'price': 1.5, 'raw': [1],
+         'label': 'title', 'nested': 'value', 'default': 2},
+        {'name': 'test', 'number': '12', 'active': 'false', 'price': '1'},
+        {'name': None},
+        {},
+        {'name': 1, 'code': 'abcd', 'state': 'other', 'number': 'a',
+         'strict': '1', 'active': 'other', 'price': 'a', 'title': 'a'},
+        {'name': 'test', 'number': True, 'state': ['draft']},
+        {'name': 'test', 'unknown': 1},
+        ['name'],
+    ])
+    def test_same_result(self, data):
+        self.load(data)
+
+    def test_unknown(self):
+        data = {'name': 'test', 'other.value': 1}
+        assert self.load(data, unknown=EXCLUDE)[0] == 'ok'
+        assert self.load(data, unknown=INCLUDE) == (
+            'ok', {'name': 'test', 'default': 10, 'other': {'value': 1}})
+
+    def test_partial(self):
+        assert self.load({'code': 'abc'}, partial=True) == (
+            'ok', {'code': 'abc'})
+        assert self.load({'code': 'abc'}, partial=('name',)) == (
+            'ok', {'code': 'abc', 'default': 10})
+
+    def test_many(self):
+        result = self.load([{'name': 'test'}, {'code': 'abcd'}, 1],
+                           many=True)
+        assert sorted(result[1]) == [1, 2]
+        self.load({'name': 'test'}, many=True)
+
+    def test_unhashable_value_of_one_of(self):
+        assert self.load({'name': 'test', 'choice': ['x']}) == (
+            'ko', {'choice': ['Must be one of: x, y.']},
+            {'name': 'test', 'default': 10})
+        assert self.load({'name': 'test', 'choice': 'x'}) == (
+            'ok', {'name': 'test', 'choice': 'x', 'default': 10})
+
+    def test_validate(self):
+        data = [{'name': 'test'}, {'name': 1, 'state': 'other'}]
+        assert (
+            install_load(FlatSchema()).validate(data, many=True) ==
+            FlatSchema().validate(data, many=True)
+        )
+
+
+class TestCompiledLoadWrapper:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_simple_model):
+        transaction = registry_simple_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.mark.parametrize('data', [
+        {'name': 'test', 'number': 1},
+        {'name': 'test', 'number': 'a'},
+        {'number': 1},
+        {'name': 'test', 'other': 1},
+    ])
+    def test_same_result(self, registry_simple_model, data):
+        results = []
+        for compiled_load in (False, True):
+            schema = ExempleSchema(
+                registry=registry_simple_model, compiled_load=compiled_load)
+            try:
+                results.append(schema.load(data))
+            except ValidationError as e:
+                results.append(e.messages)
+
+            results.append(schema.validate(data))
+
+        assert results[:2] == results[2:]
+
+    def test_compiled_by_call(self, registry_simple_model):
+        schema = ExempleSchema(registry=registry_simple_model)
+        assert schema.load({'name': 'test'}, compiled_load=True) == {
+            'name': 'test'}
+        compiled = [x for x in schema.schemas.values()
+                    if '_deserialize' in x.__dict__]
+        assert len(compiled) == 1
+        assert len(schema.schemas) == 1
+        schema.load({'name': 'test'})
+        assert len(schema.schemas) == 2
+
+    def test_load_without_field_loop(self, registry_simple_model,
+                                     monkeypatch):
+        calls = []
+        deserialize = Field.deserialize
+
+        def wrapper(self, *args, **kwargs):
+            calls.append(self)
+            return deserialize(self, *args, **kwargs)
+
+        monkeypatch.setattr(Field, 'deserialize', wrapper)
+        schema = ExempleSchema(registry=registry_simple_model)
+        data = [{'name': 'test %d' % i, 'number': i} for i in range(10)]
+        schema.load(data, many=True)
+        assert len(calls) == 30
+        del calls[:]
+        schema.load(data, many=True, compiled_load=True)
+        assert len(calls) == 0
@@ -61,3 +61,7 @@ class TestDecorator:
             assert a.get_result_with_exception(v1='other')
 
         assert a.v1 == 'test'
+
+    def test_deprecated(self):
+        with pytest.deprecated_call():
+            update_from_kwargs('v1')
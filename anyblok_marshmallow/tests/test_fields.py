@@ -8,7 +8,8 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 import pytest
 from .conftest import init_registry
-from anyblok_marshmallow import SchemaWrapper
+from anyblok_marshmallow import (
+    SchemaWrapper, InstanceFieldSchema, InstanceCache)
 from anyblok_marshmallow import fields
 from anyblok import Declarations
 from anyblok.column import (
@@ -21,6 +22,7 @@ from marshmallow.exceptions import ValidationError
 from marshmallow import Schema
 from uuid import uuid1
 from sqlalchemy_utils import PhoneNumber as PN
+from anyblok_marshmallow.cache import LRUCache
 
 try:
     import colour  # noqa
@@ -208,6 +210,21 @@ class TestFieldSelectionWithObject:
         errors = exemple_schema.validate(dump_data)
         assert errors['name'][0].startswith('Must be one of: ')
 
+    def test_selection_validator_shared_between_schemas(
+        self, registry_field_selection_with_object
+    ):
+        registry = registry_field_selection_with_object
+        schema1 = SchemaWrapper(
+            registry=registry, context={'model': "Model.Exemple"}).schema
+        schema2 = SchemaWrapper(
+            registry=registry, required_fields=True,
+            context={'model': "Model.Exemple"}).schema
+        assert schema1.__class__ is not schema2.__class__
+        validator1 = schema1.fields['name'].validators[-1]
+        validator2 = schema2.fields['name'].validators[-1]
+        assert validator1 is validator2
+        assert validator1.choices_set == frozenset(('foo', 'bar'))
+
 
 def add_field_selection_with_classmethod():
 
@@ -1320,6 +1337,212 @@ class TestFieldInstance:
         )
 
 
+def add_field_instance_batch():
+
+    @Declarations.register(Declarations.Model)
+    class Records:
+        id = Integer(primary_key=True)
+        code = String()
+        number = Integer()
+
+
+@pytest.fixture(scope="class")
+def registry_field_instance_batch(request, bloks_loaded):
+    registry = init_registry(add_field_instance_batch)
+    request.addfinalizer(registry.close)
+    return registry
+
+
+class TestFieldInstanceBatch:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_field_instance_batch):
+        transaction = registry_field_instance_batch.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def queries(self, registry_field_instance_batch, capture_statements):
+        return capture_statements(
+            registry_field_instance_batch, startswith='SELECT',
+            contains='FROM records')
+
+    def getSchema(self, registry):
+
+        class TestSchema(InstanceFieldSchema, Schema):
+            code = fields.InstanceField(
+                        cls_or_instance_type=fields.Str(),
+                        model='Model.Records', key='code')
+            number = fields.InstanceField(
+                        cls_or_instance_type=fields.List(fields.Int()),
+                        model='Model.Records', key='number')
+
+        return TestSchema(context={"registry": registry})
+
+    def test_instance_field_many(self, registry_field_instance_batch, queries):
+        registry = registry_field_instance_batch
+        for i in range(3):
+            registry.Records.insert(code="code%s" % i, number=i + 1)
+
+        registry.flush()
+        sch = self.getSchema(registry)
+        data = [dict(code="code%d" % (i % 3), number=[i % 3 + 1])
+                for i in range(10)]
+        assert sch.load(data, many=True) == data
+        assert len(queries) == 2
+
+    def getStringSchema(self, registry):
+
+        class TestSchema(InstanceFieldSchema, Schema):
+            number = fields.InstanceField(
+                        cls_or_instance_type=fields.Str(),
+                        model='Model.Records', key='number')
+
+        return TestSchema(context={"registry": registry})
+
+    def test_instance_field_many_converted_by_column(
+        self, registry_field_instance_batch
+    ):
+        registry = registry_field_instance_batch
+        for i in range(3):
+            registry.Records.insert(code="code%s" % i, number=i + 1)
+
+        registry.flush()
+        sch = self.getStringSchema(registry)
+        data = [dict(number="1"), dict(number="2"), dict(number="3")]
+        assert sch.load(data, many=True) == data
+        with pytest.raises(ValidationError) as exception:
+            sch.load(data + [dict(number="4")], many=True)
+
+        assert list(exception._excinfo[1].messages.keys()) == [3]
+
+    def test_instance_field_many_converted_by_column_with_instance_cache(
+        self, registry_field_instance_batch, queries
+    ):
+        registry = registry_field_instance_batch
+        for i in range(3):
+            registry.Records.insert(code="code%s" % i, number=i + 1)
+
+        registry.flush()
+        cache = InstanceCache()
+        sch = self.getStringSchema(registry)
+        sch.context['instance_cache'] = cache
+        data = [dict(number="1"), dict(number="2"), dict(number="3")]
+        assert sch.load(data, many=True) == data
+        del queries[:]
+        assert sch.load(data, many=True) == data
+        assert sch.load(dict(number="2")) == dict(number="2")
+        assert not queries
+
+    def test_instance_field_many_errors(
+        self, registry_field_instance_batch, queries
+    ):
+        registry = registry_field_instance_batch
+        for i in range(3):
+            registry.Records.insert(code="code%s" % i, number=i + 1)
+
+        registry.flush()
+        sch = self.getSchema(registry)
+        data = [
+            dict(code="code0", number=[1]),
+            dict(code="unexisting", number=[2]),
+            dict(code="code1", number=[2, 666]),
+            dict(code=666, number=["NAN"]),
+        ]
+        with pytest.raises(ValidationError) as exception:
+            sch.load(data, many=True)
+
+        # 2 batches and the values not found are checked alone
+        assert len(queries) == 4
+        errors = exception._excinfo[1].messages
+        assert list(errors.keys()) == [1, 2, 3]
+        assert errors[1] == {
+            'code': [
+                "Record with key 'code' = 'unexisting' on "
+                "<class 'anyblok.model.factory.ModelRecords'> not found"
+            ],
+        }
+        assert errors[2] == {
+            'number': [
+                "Records with key 'number' = [666] on "
+                "<class 'anyblok.model.factory.ModelRecords'> not found"
+            ],
+        }
+        assert errors[3] == {
+            'code': ["Not a valid string."],
+            'number': {0: ["Not a valid integer."]},
+        }
+
+    def test_instance_field_many_same_errors_as_one(
+        self, registry_field_instance_batch
+    ):
+        registry = registry_field_instance_batch
+        registry.Records.insert(code="code0", number=1)
+        sch = self.getSchema(registry)
+        data = [dict(code="code0", number=[1, 2, 3]), dict(code="other")]
+        with pytest.raises(ValidationError) as exception:
+            sch.load(data, many=True)
+
+        errors = exception._excinfo[1].messages
+        for index, entry in enumerate(data):
+            with pytest.raises(ValidationError) as exception:
+                sch.load(entry)
+
+            assert errors[index] == exception._excinfo[1].messages
+
+    def test_instance_field_without_many(
+        self, registry_field_instance_batch, queries
+    ):
+        registry = registry_field_instance_batch
+        registry.Records.insert(code="code0", number=1)
+        registry.flush()
+        sch = self.getSchema(registry)
+        sch.load([dict(code="code0", number=[1])], many=True)
+        assert 'instance_fields' in sch.context
+        del queries[:]
+        assert sch.load(dict(code="code0")) == dict(code="code0")
+        assert 'instance_fields' not in sch.context
+        assert len(queries) == 1
+
+    def test_instance_field_with_instance_cache(
+        self, registry_field_instance_batch, queries
+    ):
+        registry = registry_field_instance_batch
+        registry.Records.insert(code="code0", number=1)
+        registry.Records.insert(code="code1", number=2)
+        registry.flush()
+        cache = InstanceCache()
+        sch = self.getSchema(registry)
+        sch.context['instance_cache'] = cache
+        assert sch.load(dict(code="code0")) == dict(code="code0")
+        assert sch.load(dict(code="code0")) == dict(code="code0")
+        assert sch.load(dict(number=[1, 2])) == dict(number=[1, 2])
+        assert sch.load(dict(number=[2, 1])) == dict(number=[2, 1])
+        for i in range(2):
+            with pytest.raises(ValidationError):
+                sch.load(dict(code="unexisting"))
+
+        assert len(queries) == 3
+        assert len(cache) == 4
+
+    def test_instance_field_many_with_shared_instance_cache(
+        self, registry_field_instance_batch, queries
+    ):
+        registry = registry_field_instance_batch
+        registry.Records.insert(code="code0", number=1)
+        registry.Records.insert(code="code1", number=2)
+        registry.flush()
+        cache = InstanceCache()
+        sch1 = self.getSchema(registry)
+        sch1.context['instance_cache'] = cache
+        sch2 = self.getSchema(registry)
+        sch2.context['instance_cache'] = cache
+        data = [dict(code="code0"), dict(code="code1")]
+        assert sch1.load(data, many=True) == data
+        assert sch2.load(data, many=True) == data
+        assert sch2.load(dict(code="code1")) == dict(code="code1")
+        assert len(queries) == 1
+
+
 def add_field_url():
 
     @Declarations.register(Declarations.Model)
@@ -1500,6 +1723,82 @@ class TestFieldPhonenumber:
                 'The string supplied did not seem to be a phone number.']}
         )
 
+    @pytest.fixture
+    def cache(self, monkeypatch):
+        cache = LRUCache(maxsize=10)
+        monkeypatch.setattr(fields.PhoneNumber, 'cache', cache)
+        return cache
+
+    @pytest.fixture
+    def valid_cache(self, monkeypatch):
+        cache = LRUCache(maxsize=10)
+        monkeypatch.setattr(fields.PhoneNumber, 'valid_cache', cache)
+        return cache
+
+    def get_schema(self):
+
+        class ExamplePhoneNumberSchema(Schema):
+            phonenumber = fields.PhoneNumber(region='FR')
+
+        return ExamplePhoneNumberSchema()
+
+    def test_phonenumber_parsed_once(self, cache, valid_cache, monkeypatch):
+        sch = self.get_schema()
+        expected = PN("+33953537297", None)
+        pn1 = sch.load(dict(phonenumber='09 53 53 72 97'))['phonenumber']
+        monkeypatch.setattr(PN, '__init__', None)
+        monkeypatch.setattr(PN, 'is_valid_number', None)
+        pn2 = sch.load(dict(phonenumber='09 53 53 72 97'))['phonenumber']
+        assert pn1 is not pn2
+        assert pn1 == pn2 == expected
+        assert cache.cache_info().hits == 1
+        # validity of the two loads
+        assert valid_cache.cache_info().hits == 2
+
+    def test_phonenumber_copy_by_load(self, cache, valid_cache):
+        sch = self.get_schema()
+        pn1 = sch.load(dict(phonenumber='09 53 53 72 97'))['phonenumber']
+        pn1.extension = '99'
+        pn1._phone_number.extension = '99'
+        pn2 = sch.load(dict(phonenumber='09 53 53 72 97'))['phonenumber']
+        assert pn2.extension is None
+        assert pn2._phone_number.extension is None
+
+    def test_phonenumber_invalid_parsed_once(self, cache):
+        sch = self.get_schema()
+        for i in range(2):
+            with pytest.raises(ValidationError):
+                sch.load(dict(phonenumber='anyblok'))
+
+        assert cache.cache_info().hits == 1
+        assert cache.cache_info().currsize == 1
+
+    def test_phonenumber_not_valid_cached(self, cache, valid_cache):
+        sch = self.get_schema()
+        for i in range(2):
+            with pytest.raises(ValidationError) as exception:
+                sch.load(dict(phonenumber='+3312'))
+
+            assert exception.value.messages == {
+                'phonenumber': {'valid': 'Is not a valid number'}}
+
+        assert cache.cache_info().hits == 1
+        assert valid_cache.cache_info().hits == 2
+
+    def test_phonenumber_cache_by_region(self, cache):
+        pn1 = fields.PhoneNumber.parse('020 8366 1177', 'FR')
+        pn2 = fields.PhoneNumber.parse('020 8366 1177', 'GB')
+        assert pn1 != pn2
+        assert pn2 == PN("+442083661177", None)
+        assert cache.cache_info().misses == 2
+
+    def test_phonenumber_cache_size(self, cache):
+        sch = self.get_schema()
+        for i in range(20):
+            sch.load(dict(phonenumber='09 53 53 72 %02d' % i))
+
+        assert cache.cache_info().currsize == 10
+
 
 def add_field_country():
 
@@ -1531,6 +1830,20 @@ class TestFieldCountry:
         assert (
             isinstance(exemple_schema.schema.fields['country'], fields.Country))
 
+    def test_country_validator_shared_between_schemas(
+        self, registry_field_country
+    ):
+        registry = registry_field_country
+        schema1 = SchemaWrapper(
+            registry=registry, context={'model': "Model.Exemple"}).schema
+        schema2 = SchemaWrapper(
+            registry=registry, required_fields=True,
+            context={'model': "Model.Exemple"}).schema
+        validator1 = schema1.fields['country'].validators[-1]
+        validator2 = schema2.fields['country'].validators[-1]
+        assert validator1 is validator2
+        assert 'FRA' in validator1.choices_set
+
     def test_dump_country(self, registry_field_country):
         registry = registry_field_country
         exemple = registry.Exemple.insert(
@@ -1668,6 +1981,61 @@ class TestFieldCountry:
                 'country': 'French Republic'
                 }
 
+    def test_country_case_insensitive(self):
+
+        class ExampleCountrySchema(Schema):
+            country = fields.Country(mode=fields.Country.Modes.NAME)
+
+        sch = ExampleCountrySchema()
+        country = sch.load(dict(country='france'))
+        assert country.get('country') == pycountry.countries.get(
+                alpha_3='FRA')
+
+    def test_country_not_a_string(self):
+
+        class ExampleCountrySchema(Schema):
+            country = fields.Country(mode=fields.Country.Modes.NUMERIC)
+
+        sch = ExampleCountrySchema()
+        with pytest.raises(ValidationError) as exception:
+            sch.load(dict(country=250))
+
+        assert exception.value.messages == {
+            'country': ['Not a valid country.']}
+
+    def test_country_dump_string(self):
+
+        class ExampleCountrySchema(Schema):
+            country = fields.Country(
+                    load_mode=fields.Country.Modes.ALPHA_3,
+                    dump_mode=fields.Country.Modes.NAME
+                    )
+
+        sch = ExampleCountrySchema()
+        assert sch.dump(dict(country='FRA')) == {'country': 'France'}
+        assert sch.dump(dict(country='ARF')) == {'country': None}
+
+    def test_country_lookup_without_pycountry_get(self, monkeypatch):
+
+        def get(*args, **kwargs):
+            raise Exception('pycountry must not be called')
+
+        fields.Country.warm_up()
+        monkeypatch.setattr(pycountry.countries, 'get', get)
+
+        class ExampleCountrySchema(Schema):
+            country = fields.Country(mode=fields.Country.Modes.ALPHA_2)
+
+        sch = ExampleCountrySchema()
+        country = sch.load(dict(country='FR'))
+        assert country['country'].alpha_3 == 'FRA'
+
+    def test_country_warm_up_once(self):
+        tables = fields.Country.warm_up()
+        assert fields.Country.warm_up() is tables
+        for mode in fields.Country.Modes:
+            assert tables[0][mode]
+
     def test_country_unknown_mode(self):
 
         with pytest.raises(ValueError) as exception:
@@ -0,0 +1,84 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import pytest
+from . import CustomerSchema
+from anyblok_marshmallow import SchemaWrapper
+
+
+class TestNested:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_complexe_model):
+        transaction = registry_complexe_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def count_schemas(self, monkeypatch):
+        counter = {'wrappers': 0, 'schemas': 0}
+        init = SchemaWrapper.__init__
+        generate = SchemaWrapper.generate_marsmallow_instance
+
+        def wrapper_init(self, *args, **kwargs):
+            counter['wrappers'] += 1
+            return init(self, *args, **kwargs)
+
+        def generate_marsmallow_instance(self, *args, **kwargs):
+            before = len(self.schemas)
+            schema = generate(self, *args, **kwargs)
+            counter['schemas'] += len(self.schemas) - before
+            return schema
+
+        monkeypatch.setattr(SchemaWrapper, '__init__', wrapper_init)
+        monkeypatch.setattr(SchemaWrapper, 'generate_marsmallow_instance',
+                            generate_marsmallow_instance)
+        return counter
+
+    def add_customers(self, registry, nb_customers, nb_addresses):
+        city = registry.City.insert(name="Rouen", zipcode="76000")
+        tag = registry.Tag.insert(name="tag 1")
+        customers = []
+        for i in range(nb_customers):
+            customer = registry.Customer.insert(name="C%d" % i)
+            customer.tags.append(tag)
+            for j in range(nb_addresses):
+                registry.Address.insert(
+                    customer=customer, city=city, street="Street %d" % j)
+
+            customers.append(customer)
+
+        return customers
+
+    def dump_and_count(self, registry, counter, customers):
+        customer_schema = CustomerSchema(registry=registry)
+        counter['wrappers'] = counter['schemas'] = 0
+        data = customer_schema.dump(customers, many=True)
+        assert len(data) == len(customers)
+        return dict(counter)
+
+    def test_number_of_nested_schema_does_not_depend_on_rows(
+        self, registry_complexe_model, count_schemas
+    ):
+        registry = registry_complexe_model
+        customers = self.add_customers(registry, 10, 3)
+        one = self.dump_and_count(registry, count_schemas, customers[:1])
+        ten = self.dump_and_count(registry, count_schemas, customers)
+        assert one == ten
+        # AddressSchema, CitySchema and TagSchema
+        assert ten['wrappers'] == 3
+
+    def test_nested_context_propagated(self, registry_complexe_model):
+        registry = registry_complexe_model
+        customer = self.add_customers(registry, 1, 1)[0]
+        customer_schema = CustomerSchema(registry=registry)
+        customer_schema.dump(customer)
+        customer_schema.schema.context['other'] = 'value'
+        customer_schema.dump(customer)
+        nested_schema = customer_schema.schema.fields['addresses'].schema
+        assert nested_schema.schema.context['other'] == 'value'
+        city_schema = nested_schema.schema.fields['city'].schema
+        assert city_schema.schema.context['other'] == 'value'
@@ -7,7 +7,9 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 import pytest
 from . import CustomerSchema
-from anyblok_marshmallow import SchemaWrapper, PostLoadSchema
+from anyblok_marshmallow import SchemaWrapper, PostLoadSchema, InstanceCache
+from marshmallow import post_load
+from anyblok_marshmallow.fields import Nested
 from marshmallow.exceptions import ValidationError
 
 
@@ -40,6 +42,67 @@ class PostLoadCustomSchema3(CustomerSchema):
         post_load_attributes = ['ko']
 
 
+class PostLoadBatchCustomSchema(CustomerSchema):
+    class Schema(CustomerSchema.Schema, PostLoadSchema):
+        post_load_batch_size = 2
+
+
+class PostLoadBatchCustomSchema2(CustomerSchema):
+    class Schema(CustomerSchema.Schema, PostLoadSchema):
+        post_load_attributes = ['name']
+        post_load_batch_size = 100
+
+
+class PostLoadBatchCustomSchema3(CustomerSchema):
+    class Schema(CustomerSchema.Schema, PostLoadSchema):
+        post_load_attributes = ['ko']
+        post_load_batch_size = 100
+
+
+class PostLoadHookCustomSchema(CustomerSchema):
+    class Schema(CustomerSchema.Schema, PostLoadSchema):
+        post_load_attributes = ['name']
+
+        @post_load
+        def clean_name(self, data, **kwargs):
+            data['name'] = data['name'].strip()
+            return data
+
+
+class PostLoadBatchHookCustomSchema(CustomerSchema):
+    class Schema(PostLoadHookCustomSchema.Schema):
+        post_load_batch_size = 100
+
+
+class AddressBatchSchema(SchemaWrapper):
+    model = "Model.Address"
+
+    class Schema(PostLoadSchema):
+        customer = Nested(PostLoadCustomSchema, only=('id',))
+        post_load_attributes = ['customer', 'street']
+        post_load_batch_size = 100
+
+
+class ColumnBatchSchema2(SchemaWrapper):
+    model = "Model.System.Column"
+
+    class Schema(PostLoadSchema):
+        post_load_attributes = ['model', 'name']
+        post_load_batch_size = 100
+
+
+class ColumnBatchSchema(SchemaWrapper):
+    model = "Model.System.Column"
+
+    class Schema(PostLoadSchema):
+        post_load_batch_size = 100
+
+
+@pytest.fixture
+def count_queries(registry_complexe_model, capture_statements):
+    return capture_statements(registry_complexe_model)
+
+
 class TestPostLoad:
 
     @pytest.fixture(autouse=True)
@@ -172,3 +235,275 @@ class TestPostLoad:
                 ),
             }
         )
+
+    def test_post_load_many(self, registry_complexe_model):
+        registry = registry_complexe_model
+        customer_schema = PostLoadCustomSchema()
+        customer_schema.context['registry'] = registry
+
+        customers = [self.get_customer(registry) for i in range(3)]
+        dump_data = customer_schema.dump(customers, many=True)
+        data = customer_schema.load(dump_data, many=True)
+        assert data == customers
+
+    def test_post_load_with_own_post_load_hook(self, registry_complexe_model):
+        registry = registry_complexe_model
+        customer_schema = PostLoadHookCustomSchema()
+        customer_schema.context['registry'] = registry
+
+        customer = self.get_customer(registry)
+        customer.name = 'Hook'
+        dump_data = customer_schema.dump(customer)
+        dump_data['name'] = ' Hook '
+        assert customer_schema.load(dump_data) is customer
+        assert customer_schema.load([dump_data], many=True) == [customer]
+
+    def test_post_load_batch_with_own_post_load_hook(
+        self, registry_complexe_model
+    ):
+        registry = registry_complexe_model
+        customer_schema = PostLoadBatchHookCustomSchema()
+        customer_schema.context['registry'] = registry
+
+        customers = []
+        for i in range(3):
+            customer = self.get_customer(registry)
+            customer.name = 'Hook %d' % i
+            customers.append(customer)
+
+        dump_data = customer_schema.dump(customers, many=True)
+        dump_data[1]['name'] = ' Hook 1 '
+        assert customer_schema.load(dump_data, many=True) == customers
+
+    def test_post_load_batch_instances_not_kept(
+        self, registry_complexe_model
+    ):
+        registry = registry_complexe_model
+        customer_schema = PostLoadBatchCustomSchema()
+        customer_schema.context['registry'] = registry
+
+        customers = [self.get_customer(registry) for i in range(3)]
+        dump_data = customer_schema.dump(customers, many=True)
+        customer_schema.load(dump_data, many=True)
+        schema = customer_schema.schema
+        assert 'post_load_instances' not in schema.context
+        dump_data[1]['id'] = max(x.id for x in customers) + 1
+        with pytest.raises(ValidationError):
+            customer_schema.load(dump_data, many=True)
+
+        assert customer_schema.schema is schema
+        assert 'post_load_instances' not in schema.context
+
+    def test_post_load_batch(self, registry_complexe_model, count_queries):
+        registry = registry_complexe_model
+        customer_schema = PostLoadBatchCustomSchema()
+        customer_schema.context['registry'] = registry
+
+        customers = [self.get_customer(registry) for i in range(5)]
+        dump_data = customer_schema.dump(customers, many=True)
+        registry.flush()
+        del count_queries[:]
+        data = customer_schema.load(dump_data, many=True)
+        assert data == customers
+        queries = [
+            x for x in count_queries
+            if x.startswith('SELECT') and 'FROM customer' in x
+        ]
+        assert len(queries) == 3  # 5 customers by chunk of 2
+
+    def test_post_load_batch_without_many(self, registry_complexe_model):
+        registry = registry_complexe_model
+        customer_schema = PostLoadBatchCustomSchema()
+        customer_schema.context['registry'] = registry
+
+        customer = self.get_customer(registry)
+        dump_data = customer_schema.dump(customer)
+        data = customer_schema.load(dump_data)
+        assert data is customer
+
+    def test_post_load_batch_with_polymorphism(self, registry_complexe_model):
+        registry = registry_complexe_model
+        column_schema = ColumnBatchSchema()
+        column_schema.context['registry'] = registry
+
+        columns = registry.System.Column.query().limit(10).all()
+        dump_data = column_schema.dump(columns, many=True)
+        data = column_schema.load(dump_data, many=True)
+        assert data == columns
+
+    def test_post_load_batch_no_instance_found(self, registry_complexe_model):
+        registry = registry_complexe_model
+        customer_schema = PostLoadBatchCustomSchema()
+        customer_schema.context['registry'] = registry
+
+        customers = [self.get_customer(registry) for i in range(3)]
+        dump_data = customer_schema.dump(customers, many=True)
+        dump_data[1]['id'] = max(x.id for x in customers) + 1
+        with pytest.raises(ValidationError) as exception:
+            customer_schema.load(dump_data, many=True)
+
+        assert (
+            exception._excinfo[1].messages ==
+            {
+                'instance': (
+                    "No instance of <class 'anyblok.model.factory."
+                    "ModelCustomer'> found with the filter keys ['id']"
+                ),
+            }
+        )
+
+    def test_post_load_batch_with_specific_field(
+        self, registry_complexe_model, count_queries
+    ):
+        registry = registry_complexe_model
+        customer_schema = PostLoadBatchCustomSchema2()
+        customer_schema.context['registry'] = registry
+
+        customers = []
+        for i in range(5):
+            customer = self.get_customer(registry)
+            customer.name = 'C%d' % i
+            customers.append(customer)
+
+        dump_data = customer_schema.dump(customers, many=True)
+        registry.flush()
+        del count_queries[:]
+        data = customer_schema.load(dump_data, many=True)
+        assert data == customers
+        queries = [
+            x for x in count_queries
+            if x.startswith('SELECT') and 'FROM customer' in x
+        ]
+        assert len(queries) == 1
+
+    def test_post_load_batch_with_specific_fields_polymorphic(
+        self, registry_complexe_model
+    ):
+        registry = registry_complexe_model
+        column_schema = ColumnBatchSchema2()
+        column_schema.context['registry'] = registry
+
+        columns = registry.System.Column.query().limit(10).all()
+        dump_data = column_schema.dump(columns, many=True)
+        data = column_schema.load(dump_data, many=True)
+        assert data == columns
+
+    def test_post_load_batch_with_relationship(self, registry_complexe_model):
+        registry = registry_complexe_model
+        address_schema = AddressBatchSchema()
+        address_schema.context['registry'] = registry
+
+        addresses = []
+        for i in range(3):
+            customer = self.get_customer(registry)
+            addresses.extend(customer.addresses)
+
+        dump_data = address_schema.dump(addresses, many=True)
+        data = address_schema.load(dump_data, many=True)
+        assert data == addresses
+
+    def test_post_load_batch_with_specific_field_wrong_field(
+        self, registry_complexe_model
+    ):
+        registry = registry_complexe_model
+        customer_schema = PostLoadBatchCustomSchema3()
+        customer_schema.context['registry'] = registry
+
+        customers = [self.get_customer(registry) for i in range(2)]
+        dump_data = customer_schema.dump(customers, many=True)
+        with pytest.raises(ValidationError) as exception:
+            customer_schema.load(dump_data, many=True)
+
+        assert (
+            exception._excinfo[1].messages ==
+            {'KeyError': "'ko' is unknow in the data"}
+        )
+
+    def test_post_load_batch_with_more_than_one_instance(
+        self, registry_complexe_model
+    ):
+        registry = registry_complexe_model
+        customer_schema = PostLoadBatchCustomSchema2()
+        customer_schema.context['registry'] = registry
+
+        customer1 = self.get_customer(registry)
+        customer2 = self.get_customer(registry)
+        customer3 = self.get_customer(registry)
+        customer3.name = 'C3'
+        dump_data = customer_schema.dump(
+            [customer1, customer3, customer2], many=True)
+        with pytest.raises(ValidationError) as exception:
+            customer_schema.load(dump_data, many=True)
+
+        message = (
+            "2 instances of <class 'anyblok.model.factory."
+            "ModelCustomer'> found with the filter keys ['name']"
+        )
+        assert (
+            exception._excinfo[1].messages ==
+            {'instance': message}
+        )
+
+    def get_customer_queries(self, queries):
+        return [
+            x for x in queries
+            if x.startswith('SELECT') and 'FROM customer' in x
+        ]
+
+    def test_post_load_with_instance_cache(
+        self, registry_complexe_model, count_queries
+    ):
+        registry = registry_complexe_model
+        cache = InstanceCache()
+        customer_schema = PostLoadCustomSchema(
+            context={'registry': registry, 'instance_cache': cache})
+
+        customer = self.get_customer(registry)
+        dump_data = customer_schema.dump(customer)
+        registry.flush()
+        del count_queries[:]
+        assert customer_schema.load(dump_data) is customer
+        assert self.get_customer_queries(count_queries)
+        del count_queries[:]
+        assert customer_schema.load(dump_data) is customer
+        assert not self.get_customer_queries(count_queries)
+
+    def test_post_load_with_instance_cache_negative_lookup(
+        self, registry_complexe_model, count_queries
+    ):
+        registry = registry_complexe_model
+        cache = InstanceCache()
+        customer_schema = PostLoadCustomSchema2(
+            context={'registry': registry, 'instance_cache': cache})
+
+        customer = self.get_customer(registry)
+        dump_data = customer_schema.dump(customer)
+        dump_data['name'] = 'unknown'
+        registry.flush()
+        del count_queries[:]
+        for i in range(2):
+            with pytest.raises(ValidationError):
+                customer_schema.load(dump_data)
+
+        assert len(self.get_customer_queries(count_queries)) == 1
+
+    def test_post_load_batch_with_shared_instance_cache(
+        self, registry_complexe_model, count_queries
+    ):
+        registry = registry_complexe_model
+        cache = InstanceCache()
+        context = {'registry': registry, 'instance_cache': cache}
+        customers = [self.get_customer(registry) for i in range(3)]
+        dump_data = PostLoadBatchCustomSchema(context=context).dump(
+            customers, many=True)
+        registry.flush()
+        del count_queries[:]
+        data = PostLoadBatchCustomSchema(context=context).load(
+            dump_data[:2], many=True)
+        assert data == customers[:2]
+        data = PostLoadBatchCustomSchema(context=context).load(
+            dump_data, many=True)
+        assert data == customers
+        data = PostLoadCustomSchema(context=context).load(dump_data[2])
+        assert data is customers[2]
+        assert len(self.get_customer_queries(count_queries)) == 2
@@ -0,0 +1,379 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import json
+import pytest
+from sqlalchemy import event
+from .conftest import init_registry
+from . import CustomerSchema
+from anyblok import Declarations
+from anyblok.column import Integer, String, Selection, Text
+from anyblok_marshmallow import SchemaWrapper, fields
+
+
+def add_query_model():
+
+    @Declarations.register(Declarations.Model)
+    class QueryExemple:
+        id = Integer(primary_key=True)
+        name = String(nullable=False)
+        state = Selection(selections={'draft': 'Draft', 'done': 'Done'},
+                          default='draft')
+        description = Text()
+
+
+@pytest.fixture(scope="class")
+def registry_query_model(request, bloks_loaded):
+    registry = init_registry(add_query_model)
+    request.addfinalizer(registry.close)
+    return registry
+
+
+class QueryExempleSchema(SchemaWrapper):
+    model = 'Model.QueryExemple'
+
+
+class TestDumpQuery:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_query_model):
+        transaction = registry_query_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def statements(self, registry_query_model, capture_statements):
+        return capture_statements(registry_query_model)
+
+    @pytest.fixture
+    def loaded(self, request, registry_query_model):
+        loaded = []
+
+        def load(target, context):
+            loaded.append(target)
+
+        Model = registry_query_model.QueryExemple
+        event.listen(Model, 'load', load)
+        request.addfinalizer(lambda: event.remove(Model, 'load', load))
+        return loaded
+
+    def add_exemples(self, registry):
+        for i in range(10):
+            registry.QueryExemple.insert(
+                name="test %d" % i, state='done' if i % 2 else 'draft',
+                description='a long text ' * 100)
+
+        registry.flush()
+        registry.expire_all()
+
+    def test_dump_query(self, registry_query_model):
+        registry = registry_query_model
+        self.add_exemples(registry)
+        schema = QueryExempleSchema(registry=registry)
+        Model = registry.QueryExemple
+        query = Model.query().order_by(Model.id)
+        assert schema.dump_query(query) == schema.dump(query.all(), many=True)
+
+    def test_dump_filtered_query(self, registry_query_model):
+        registry = registry_query_model
+        self.add_exemples(registry)
+        schema = QueryExempleSchema(registry=registry)
+        query = registry.QueryExemple.query().filter_by(state='done')
+        data = schema.dump_query(query)
+        assert len(data) == 5
+        assert {x['state'] for x in data} == {'done'}
+
+    def test_dump_query_without_instance(
+        self, registry_query_model, loaded
+    ):
+        registry = registry_query_model
+        self.add_exemples(registry)
+        schema = QueryExempleSchema(registry=registry)
+        schema.dump_query(registry.QueryExemple.query())
+        assert not loaded
+        schema.dump(registry.QueryExemple.query(), many=True)
+        assert len(loaded) == 10
+
+    def test_dump_query_select_only_fields(
+        self, registry_query_model, statements
+    ):
+        registry = registry_query_model
+        self.add_exemples(registry)
+        schema = QueryExempleSchema(registry=registry, only_primary_key=True)
+        schema.schema
+        del statements[:]
+        data = schema.dump_query(registry.QueryExemple.query())
+        assert len(data) == 10
+        assert set(data[0]) == {'id'}
+        assert len(statements) == 1
+        assert 'description' not in statements[0]
+
+    def test_dump_query_with_custom_field(self, registry_query_model):
+        registry = registry_query_model
+        self.add_exemples(registry)
+
+        class MySchema(QueryExempleSchema):
+
+            class Schema:
+                label = fields.Function(lambda obj: 'label %s' % obj.name)
+
+        schema = MySchema(registry=registry)
+        Model = registry.QueryExemple
+        query = Model.query().order_by(Model.id)
+        assert schema.dump_query(query) == schema.dump(query.all(), many=True)
+
+
+class TestDumpIter:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_query_model):
+        transaction = registry_query_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def loaded(self, request, registry_query_model):
+        loaded = []
+
+        def load(target, context):
+            loaded.append(target)
+
+        Model = registry_query_model.QueryExemple
+        event.listen(Model, 'load', load)
+        request.addfinalizer(lambda: event.remove(Model, 'load', load))
+        return loaded
+
+    def add_exemples(self, registry):
+        for i in range(10):
+            registry.QueryExemple.insert(
+                name="test %d" % i, state='done' if i % 2 else 'draft',
+                description='a long text ' * 100)
+
+        registry.flush()
+        registry.expire_all()
+
+    def get_query(self, registry):
+        Model = registry.QueryExemple
+        return Model.query().order_by(Model.id)
+
+    @pytest.mark.parametrize('compiled_dump', [False, True])
+    def test_dump_iter(self, registry_query_model, compiled_dump):
+        registry = registry_query_model
+        self.add_exemples(registry)
+        schema = QueryExempleSchema(
+            registry=registry, compiled_dump=compiled_dump)
+        query = self.get_query(registry)
+        data = list(schema.dump_iter(query))
+        assert data == schema.dump(query.all(), many=True)
+
+    def test_dump_iter_is_lazy(self, registry_query_model):
+        registry = registry_query_model
+        self.add_exemples(registry)
+        consumed = []
+
+        def exemples():
+            for exemple in self.get_query(registry).all():
+                consumed.append(exemple)
+                yield exemple
+
+        schema = QueryExempleSchema(registry=registry)
+        iterator = schema.dump_iter(exemples())
+        assert not consumed
+        assert next(iterator)['name'] == 'test 0'
+        assert len(consumed) == 1
+        assert len(list(iterator)) == 9
+        assert len(consumed) == 10
+
+    def test_dump_iter_yield_per(self, registry_query_model, loaded):
+        registry = registry_query_model
+        self.add_exemples(registry)
+        schema = QueryExempleSchema(registry=registry)
+        iterator = schema.dump_iter(self.get_query(registry), yield_per=2)
+        next(iterator)
+        assert len(loaded) == 2
+        assert len(list(iterator)) == 9
+        assert len(loaded) == 10
+
+    def test_dumps_iter(self, registry_query_model):
+        registry = registry_query_model
+        self.add_exemples(registry)
+        schema = QueryExempleSchema(registry=registry)
+        query = self.get_query(registry)
+        chunks = list(schema.dumps_iter(query))
+        assert len(chunks) == 12
+        assert ''.join(chunks) == schema.dumps(query.all(), many=True)
+
+    def test_dumps_iter_empty(self, registry_query_model):
+        registry = registry_query_model
+        schema = QueryExempleSchema(registry=registry)
+        chunks = schema.dumps_iter(self.get_query(registry))
+        assert json.loads(''.join(chunks)) == []
+
+    def test_dumps_iter_ndjson(self, registry_query_model):
+        registry = registry_query_model
+        self.add_exemples(registry)
+        schema = QueryExempleSchema(registry=registry)
+        query = self.get_query(registry)
+        lines = list(schema.dumps_iter(query, ndjson=True))
+        assert len(lines) == 10
+        assert all(x.endswith('\n') and '\n' not in x[:-1] for x in lines)
+        assert [json.loads(x) for x in lines] == schema.dump(
+            query.all(), many=True)
+
+
+class TestDumpQueryComplexeModel:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_complexe_model):
+        transaction = registry_complexe_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    def test_dump_query_with_nested(self, registry_complexe_model):
+        registry = registry_complexe_model
+        city = registry.City.insert(name="Rouen", zipcode="76000")
+        customer = registry.Customer.insert(name="C1")
+        registry.Address.insert(customer=customer, city=city, street="St")
+        schema = CustomerSchema(registry=registry)
+        query = registry.Customer.query()
+        assert schema.dump_query(query) == schema.dump(query.all(), many=True)
+
+
+class TestOptimizeQuery:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_complexe_model):
+        transaction = registry_complexe_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def statements(self, registry_complexe_model, capture_statements):
+        return capture_statements(registry_complexe_model, startswith='SELECT')
+
+    def add_customers(self, registry, nb_customers):
+        tag = registry.Tag.insert(name="tag")
+        for i in range(nb_customers):
+            city = registry.City.insert(name="City %d" % i, zipcode="7600")
+            customer = registry.Customer.insert(name="C%d" % i)
+            customer.tags.append(tag)
+            for j in range(2):
+                registry.Address.insert(
+                    customer=customer, city=city, street="Street %d" % j)
+
+        registry.flush()
+        registry.expire_all()
+
+    def count_queries(self, registry, statements, method):
+        schema = CustomerSchema(registry=registry)
+        schema.dump(registry.Customer.query().all(), many=True)
+        registry.expire_all()
+        del statements[:]
+        data = method(schema, registry.Customer.query())
+        registry.expire_all()
+        return len(statements), data
+
+    def dump(self, schema, query):
+        return schema.dump(query.all(), many=True)
+
+    def optimize_and_dump(self, schema, query):
+        return schema.dump(schema.optimize_query(query).all(), many=True)
+
+    def test_loader_options(self, registry_complexe_model):
+        registry = registry_complexe_model
+        schema = CustomerSchema(registry=registry)
+        query = schema.optimize_query(registry.Customer.query())
+        paths = [str(x.path) for x in query._with_options]
+        assert len(paths) == 2
+
+    def test_constant_number_of_queries(
+        self, registry_complexe_model, statements
+    ):
+        registry = registry_complexe_model
+        self.add_customers(registry, 2)
+        nb2, data2 = self.count_queries(
+            registry, statements, self.optimize_and_dump)
+        self.add_customers(registry, 8)
+        nb10, data10 = self.count_queries(
+            registry, statements, self.optimize_and_dump)
+        assert nb2 == nb10 == 3
+        assert len(data10) == 10
+        nb10_lazy, lazy_data10 = self.count_queries(
+            registry, statements, self.dump)
+        assert nb10_lazy > nb10
+        assert data10 == lazy_data10
+
+    def test_dump_query_optimized(self, registry_complexe_model, statements):
+        registry = registry_complexe_model
+        self.add_customers(registry, 5)
+        nb, data = self.count_queries(
+            registry, statements,
+            lambda schema, query: schema.dump_query(query))
+        nb_optimized, optimized_data = self.count_queries(
+            registry, statements, self.optimize_and_dump)
+        assert nb == nb_optimized
+        assert data == optimized_data
+
+
+class CustomerPrimaryKeySchema(SchemaWrapper):
+    model = 'Model.Customer'
+
+
+class TestProjection:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_complexe_model):
+        transaction = registry_complexe_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def statements(self, registry_complexe_model, capture_statements):
+        return capture_statements(registry_complexe_model, startswith='SELECT')
+
+    def add_customers(self, registry):
+        city = registry.City.insert(name="Rouen", zipcode="76000")
+        tag = registry.Tag.insert(name="tag")
+        for i in range(3):
+            customer = registry.Customer.insert(name="C%d" % i)
+            customer.tags.append(tag)
+            registry.Address.insert(
+                customer=customer, city=city, street="Street %d" % i)
+
+        registry.flush()
+        registry.expire_all()
+
+    def test_nested_primary_keys_are_projected(
+        self, registry_complexe_model, statements
+    ):
+        registry = registry_complexe_model
+        self.add_customers(registry)
+        schema = CustomerPrimaryKeySchema(registry=registry)
+        query = schema.optimize_query(registry.Customer.query())
+        del statements[:]
+        data = schema.dump(query.all(), many=True)
+        assert len(statements) == 3
+        assert not [x for x in statements if 'street' in x]
+        assert not [x for x in statements if 'tag.name' in x]
+        registry.expire_all()
+        assert data == schema.dump(
+            registry.Customer.query().all(), many=True)
+
+    def test_only_primary_key_is_projected(
+        self, registry_complexe_model, statements
+    ):
+        registry = registry_complexe_model
+        self.add_customers(registry)
+        schema = CustomerSchema(registry=registry, only_primary_key=True)
+        query = schema.optimize_query(registry.Customer.query())
+        del statements[:]
+        data = schema.dump(query.all(), many=True)
+        assert len(statements) == 1
+        assert 'customer.name' not in statements[0]
+        assert sorted(x['id'] for x in data) == sorted(
+            x.id for x in registry.Customer.query().all())
+
+    def test_all_columns_are_not_projected(self, registry_complexe_model):
+        registry = registry_complexe_model
+        schema = CustomerSchema(registry=registry)
+        query = schema.optimize_query(registry.Customer.query())
+        assert len(query._with_options) == 2
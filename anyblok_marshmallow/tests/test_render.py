@@ -0,0 +1,295 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import datetime as dt
+import decimal
+import io
+import json
+import uuid
+import pytest
+from marshmallow.exceptions import ValidationError
+from . import ExempleSchema
+from anyblok_marshmallow import render, set_default_render
+
+
+class CountRender:
+
+    def __init__(self):
+        self.calls = []
+
+    def dumps(self, obj, *args, **kwargs):
+        self.calls.append('dumps')
+        return json.dumps(obj, *args, **kwargs)
+
+    def loads(self, data, *args, **kwargs):
+        self.calls.append('loads')
+        return json.loads(data, *args, **kwargs)
+
+
+class TestJSONRender:
+
+    def test_dumps_types(self):
+        value = uuid.uuid4()
+        data = {
+            'uuid': value,
+            'decimal': decimal.Decimal('1.50'),
+            'datetime': dt.datetime(2019, 1, 2, 3, 4, 5),
+            'date': dt.date(2019, 1, 2),
+            'time': dt.time(3, 4, 5),
+            'timedelta': dt.timedelta(minutes=1),
+        }
+        assert json.loads(render.JSONRender().dumps(data)) == {
+            'uuid': str(value),
+            'decimal': '1.50',
+            'datetime': '2019-01-02T03:04:05',
+            'date': '2019-01-02',
+            'time': '03:04:05',
+            'timedelta': 60.0,
+        }
+
+    def test_dumps_unknown_type(self):
+        with pytest.raises(TypeError):
+            render.JSONRender().dumps({'obj': object()})
+
+    def test_loads(self):
+        assert render.JSONRender().loads('{"a": 1}') == {'a': 1}
+
+    def test_get_render(self):
+        assert isinstance(render.get_render('json'), render.JSONRender)
+        count_render = CountRender()
+        assert render.get_render(count_render) is count_render
+        assert render.get_render() is None
+
+    def test_get_unknown_render(self):
+        with pytest.raises(ValueError):
+            render.get_render('unknown')
+
+    def test_orjson(self):
+        pytest.importorskip('orjson')
+        orjson_render = render.get_render('orjson')
+        data = {'decimal': decimal.Decimal('1.50'), 'name': 'test'}
+        dumped = orjson_render.dumps(data)
+        assert isinstance(dumped, str)
+        assert orjson_render.loads(dumped) == {
+            'decimal': '1.50', 'name': 'test'}
+
+    def test_orjson_json_kwargs(self):
+        pytest.importorskip('orjson')
+        orjson_render = render.get_render('orjson')
+        data = {'name': 'test', 'id': 1}
+        assert orjson_render.dumps(data, sort_keys=True) == (
+            '{"id":1,"name":"test"}')
+        assert orjson_render.dumps(data, indent=2, sort_keys=True) == (
+            json.dumps(data, indent=2, sort_keys=True))
+        assert orjson_render.dumps(
+            data, separators=(',', ':'), ensure_ascii=False) == (
+            '{"name":"test","id":1}')
+
+    @pytest.mark.parametrize('kwargs', [
+        {'indent': 4},
+        {'separators': (', ', ': ')},
+        {'ensure_ascii': True},
+        {'cls': json.JSONEncoder},
+    ])
+    def test_orjson_unsupported_kwargs(self, kwargs):
+        pytest.importorskip('orjson')
+        with pytest.raises(TypeError):
+            render.get_render('orjson').dumps({'name': 'test'}, **kwargs)
+
+
+class TestRenderWrapper:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_simple_model):
+        transaction = registry_simple_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def default_render(self, request):
+        request.addfinalizer(lambda: set_default_render(None))
+
+    def test_dumps_with_render(self, registry_simple_model):
+        registry = registry_simple_model
+        exemple = registry.Exemple.insert(name="test", number=1)
+        count_render = CountRender()
+        schema = ExempleSchema(registry=registry, render=count_render)
+        assert schema.dumps(exemple) == ExempleSchema(
+            registry=registry).dumps(exemple)
+        assert count_render.calls == ['dumps']
+
+    def test_dumps_render_by_call(self, registry_simple_model):
+        registry = registry_simple_model
+        exemple = registry.Exemple.insert(name="test", number=1)
+        count_render = CountRender()
+        schema = ExempleSchema(registry=registry)
+        schema.dumps(exemple, render=count_render)
+        assert count_render.calls == ['dumps']
+        schema.dumps(exemple)
+        assert count_render.calls == ['dumps']
+        assert schema.render is None
+
+    def test_dumps_compiled_with_render(self, registry_simple_model):
+        registry = registry_simple_model
+        exemple = registry.Exemple.insert(name="test", number=1)
+        count_render = CountRender()
+        schema = ExempleSchema(
+            registry=registry, render=count_render, compiled_dump=True)
+        data = json.loads(schema.dumps([exemple], many=True))
+        assert data == ExempleSchema(registry=registry).dump(
+            [exemple], many=True)
+        assert count_render.calls == ['dumps']
+
+    def test_loads_with_render(self, registry_simple_model):
+        registry = registry_simple_model
+        count_render = CountRender()
+        schema = ExempleSchema(registry=registry, render=count_render)
+        data = schema.loads('{"name": "test", "number": 1}')
+        assert data == {'name': 'test', 'number': 1}
+        assert count_render.calls == ['loads']
+
+    def test_loads_many_with_render(self, registry_simple_model):
+        registry = registry_simple_model
+        schema = ExempleSchema(registry=registry, render='json')
+        data = schema.loads('[{"name": "test"}, {"name": "other"}]',
+                            many=True)
+        assert data == [{'name': 'test'}, {'name': 'other'}]
+
+    def test_default_render(self, registry_simple_model, default_render):
+        registry = registry_simple_model
+        exemple = registry.Exemple.insert(name="test", number=1)
+        count_render = CountRender()
+        set_default_render(count_render)
+        schema = ExempleSchema(registry=registry)
+        schema.dumps(exemple)
+        schema.loads('{"name": "test"}')
+        assert count_render.calls == ['dumps', 'loads']
+        other_render = CountRender()
+        schema.dumps(exemple, render=other_render)
+        assert count_render.calls == ['dumps', 'loads']
+        assert other_render.calls == ['dumps']
+
+    def test_iter_with_render(self, registry_simple_model):
+        registry = registry_simple_model
+        exemples = [registry.Exemple.insert(name="test %d" % i)
+                    for i in range(2)]
+        count_render = CountRender()
+        schema = ExempleSchema(registry=registry, render=count_render)
+        list(schema.dumps_iter(exemples, ndjson=True))
+        assert count_render.calls == ['dumps', 'dumps']
+        lines = io.StringIO('{"name": "test"}\n{"name": "other"}\n')
+        list(schema.loads_iter(lines))
+        assert count_render.calls == ['dumps', 'dumps', 'loads', 'loads']
+
+    def test_iter_with_orjson_kwargs(self, registry_simple_model):
+        pytest.importorskip('orjson')
+        registry = registry_simple_model
+        exemples = [registry.Exemple.insert(name="test %d" % i)
+                    for i in range(2)]
+        schema = ExempleSchema(registry=registry, render='orjson')
+        chunks = schema.dumps_iter(exemples, separators=(',', ':'))
+        assert json.loads(''.join(chunks)) == schema.dump(
+            exemples, many=True)
+        with pytest.raises(TypeError):
+            list(schema.dumps_iter(exemples, separators=(', ', ': ')))
+
+        assert json.loads(schema.dumps(exemples, many=True, indent=2)) == (
+            schema.dump(exemples, many=True))
+
+
+class TestMsgPackRender:
+
+    @pytest.fixture(autouse=True)
+    def msgpack_render(self):
+        pytest.importorskip('msgpack')
+        return render.get_render('msgpack')
+
+    def test_ext_types(self, msgpack_render):
+        value = uuid.uuid4()
+        data = {
+            'uuid': value,
+            'decimal': decimal.Decimal('1.50'),
+            'datetime': dt.datetime(2019, 1, 2, 3, 4, 5),
+            'date': dt.date(2019, 1, 2),
+            'time': dt.time(3, 4, 5),
+            'timedelta': dt.timedelta(minutes=1),
+            'name': 'test',
+            'number': 1,
+        }
+        payload = msgpack_render.dumps(data)
+        assert isinstance(payload, bytes)
+        assert msgpack_render.loads(payload) == data
+
+    def test_ext_types_of_fields(self, msgpack_render):
+        import pycountry
+        from colour import Color
+        from sqlalchemy_utils import PhoneNumber
+        data = {
+            'phone': PhoneNumber('+33953027113'),
+            'country': pycountry.countries.get(alpha_3='FRA'),
+            'color': Color('#ff0000'),
+        }
+        assert msgpack_render.loads(msgpack_render.dumps(data)) == {
+            'phone': '+33953027113',
+            'country': 'FRA',
+            'color': '#f00',
+        }
+
+    def test_unknown_type(self, msgpack_render):
+        with pytest.raises(TypeError):
+            msgpack_render.dumps({'obj': object()})
+
+    def test_same_instance(self, msgpack_render):
+        assert render.get_render('msgpack') is msgpack_render
+
+
+class TestMsgPackWrapper:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_simple_model):
+        pytest.importorskip('msgpack')
+        transaction = registry_simple_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    def add_exemples(self, registry):
+        return [registry.Exemple.insert(name="test %d" % i, number=i)
+                for i in range(10)]
+
+    @pytest.mark.parametrize('compiled_dump', [False, True])
+    def test_dumpb(self, registry_simple_model, compiled_dump):
+        registry = registry_simple_model
+        exemples = self.add_exemples(registry)
+        schema = ExempleSchema(
+            registry=registry, compiled_dump=compiled_dump)
+        payload = schema.dumpb(exemples, many=True)
+        assert isinstance(payload, bytes)
+        assert render.get_render('msgpack').loads(payload) == schema.dump(
+            exemples, many=True)
+
+    def test_loadb(self, registry_simple_model):
+        registry = registry_simple_model
+        schema = ExempleSchema(registry=registry)
+        payload = render.get_render('msgpack').dumps(
+            [{'name': 'test', 'number': 1}])
+        assert schema.loadb(payload, many=True) == [
+            {'name': 'test', 'number': 1}]
+
+    def test_loadb_validation(self, registry_simple_model):
+        registry = registry_simple_model
+        schema = ExempleSchema(registry=registry)
+        payload = render.get_render('msgpack').dumps({'number': 'wrong'})
+        with pytest.raises(ValidationError) as exception:
+            schema.loadb(payload)
+
+        assert 'number' in exception.value.messages
+
+    def test_payload_smaller_than_json(self, registry_simple_model):
+        registry = registry_simple_model
+        exemples = self.add_exemples(registry)
+        schema = ExempleSchema(registry=registry)
+        payload = schema.dumpb(exemples, many=True)
+        text = schema.dumps(exemples, many=True).encode('utf-8')
+        assert len(payload) < len(text)
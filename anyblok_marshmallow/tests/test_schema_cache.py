@@ -0,0 +1,526 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import gc
+import threading
+import time
+import weakref
+import pytest
+from anyblok.registry import RegistryManager
+from .conftest import init_registry
+from . import ExempleSchema, add_simple_model
+from anyblok_marshmallow import SchemaWrapper
+from marshmallow import ValidationError
+from anyblok_marshmallow.schema import ModelConverter, get_remote_wrapper
+from anyblok_marshmallow import schema as schema_module
+from anyblok_marshmallow.cache import LRUCache, SchemaCache
+
+
+class TestLRUCache:
+
+    def test_get_unknown_key(self):
+        cache = LRUCache()
+        assert cache.get('a') is None
+        assert cache.get('a', 'default') == 'default'
+        assert cache.cache_info() == (0, 2, 128, 0)
+
+    def test_set_and_get(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        assert 'a' in cache
+        assert cache.cache_info() == (1, 0, 128, 1)
+
+    def test_bounded_size(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert len(cache) == 2
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+
+    def test_remove(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.remove('a')
+        cache.remove('b')
+        assert len(cache) == 0
+
+    def test_clear(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.clear()
+        assert cache.cache_info() == (0, 0, 128, 0)
+
+
+class TestSchemaCache:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_simple_model):
+        transaction = registry_simple_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def cache(self, request):
+        cache = SchemaCache()
+        ExempleSchema.schema_cache = cache
+        request.addfinalizer(lambda: delattr(ExempleSchema, 'schema_cache'))
+        return cache
+
+    def test_share_schema_class_between_wrappers(
+        self, registry_simple_model, cache
+    ):
+        registry = registry_simple_model
+        schema1 = ExempleSchema(registry=registry)
+        schema2 = ExempleSchema(registry=registry)
+        assert schema1.schema is not schema2.schema
+        assert schema1.schema.__class__ is schema2.schema.__class__
+        assert cache.cache_info().misses == 1
+        assert cache.cache_info().currsize == 1
+
+    def test_dump_with_cached_schema_class(
+        self, registry_simple_model, cache
+    ):
+        registry = registry_simple_model
+        exemple = registry.Exemple.insert(name="test")
+        for i in range(3):
+            data = ExempleSchema(registry=registry).dump(exemple)
+            assert data == {'number': None, 'id': exemple.id, 'name': 'test'}
+
+        assert cache.cache_info().misses == 1
+        assert cache.cache_info().hits >= 2
+
+    def test_schema_class_by_options(self, registry_simple_model, cache):
+        registry = registry_simple_model
+        ExempleSchema(registry=registry).schema
+        ExempleSchema(registry=registry, only_primary_key=True).schema
+        ExempleSchema(registry=registry, required_fields=True).schema
+        ExempleSchema(registry=registry, required_fields=['name']).schema
+        assert cache.cache_info().currsize == 3
+
+    def test_schema_class_by_schema_mixin(self, registry_simple_model, cache):
+        registry = registry_simple_model
+
+        class OtherExempleSchema(ExempleSchema):
+
+            class Schema:
+                pass
+
+        ExempleSchema(registry=registry).schema
+        OtherExempleSchema(registry=registry).schema
+        assert cache.cache_info().currsize == 2
+
+    def test_invalidate_by_registry(self, registry_simple_model, cache):
+        registry = registry_simple_model
+        schema1 = ExempleSchema(registry=registry).schema
+        cache.invalidate(registry=registry)
+        assert cache.cache_info().currsize == 0
+        schema2 = ExempleSchema(registry=registry).schema
+        assert schema1.__class__ is not schema2.__class__
+
+    def test_invalidate_other_registry(self, registry_simple_model, cache):
+        registry = registry_simple_model
+        ExempleSchema(registry=registry).schema
+        cache.invalidate(registry=object())
+        assert cache.cache_info().currsize == 1
+        cache.invalidate()
+        assert cache.cache_info().currsize == 0
+
+    def test_single_build_by_concurrent_threads(
+        self, registry_simple_model, cache, monkeypatch
+    ):
+        registry = registry_simple_model
+        builds = []
+        build_marsmallow_class = ExempleSchema.build_marsmallow_class
+
+        def wrapper(self, *args, **kwargs):
+            builds.append(args)
+            time.sleep(0.05)
+            return build_marsmallow_class(self, *args, **kwargs)
+
+        monkeypatch.setattr(ExempleSchema, 'build_marsmallow_class', wrapper)
+        barrier = threading.Barrier(8)
+        classes = []
+
+        def generate():
+            wrapper = ExempleSchema(registry=registry)
+            barrier.wait()
+            classes.append(wrapper.generate_marsmallow_class(
+                registry, 'Model.Exemple', ()))
+
+        threads = [threading.Thread(target=generate) for i in range(8)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert len(builds) == 1
+        assert len(classes) == 8
+        assert all(x is classes[0] for x in classes)
+        assert cache.cache_info().misses == 1
+        assert cache.building == {}
+
+    def test_concurrent_build_of_other_keys(
+        self, registry_simple_model, cache
+    ):
+        registry = registry_simple_model
+        barrier = threading.Barrier(4)
+        classes = []
+
+        def generate(required_fields):
+            wrapper = ExempleSchema(registry=registry)
+            barrier.wait()
+            classes.append(wrapper.generate_marsmallow_class(
+                registry, 'Model.Exemple', required_fields))
+
+        threads = [
+            threading.Thread(target=generate, args=(x,))
+            for x in [(), (), ('name',), ('name',)]
+        ]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert len(set(classes)) == 2
+        assert cache.cache_info().misses == 2
+
+    def test_build_obsolete_class_again(self, registry_simple_model, cache):
+        key = (registry_simple_model, 'Model.Exemple', (), ExempleSchema.Schema)
+        cache.set(key, 'obsolete')
+        assert cache.get_or_build(
+            key, lambda: 'new', lambda x: x != 'obsolete') == 'new'
+        assert cache.get(key) == 'new'
+
+    def test_default_process_wide_cache(self):
+        from anyblok_marshmallow import schema_cache
+        assert SchemaWrapper.schema_cache is schema_cache
+
+
+class FakeRegistry:
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+
+
+class TestSchemaCacheRelease:
+
+    @pytest.fixture
+    def registries(self, monkeypatch):
+        registries = {}
+        monkeypatch.setattr(RegistryManager, 'registries', registries)
+        return registries
+
+    def add_registry(self, registries, db_name):
+        registry = registries[db_name] = FakeRegistry(db_name)
+        return registry
+
+    def test_registry_saved_by_weak_reference(self, registries):
+        cache = SchemaCache()
+        registry = self.add_registry(registries, 'db1')
+        key = (registry, 'Model.Test', False, (), None)
+        cache.set(key, 'schema')
+        assert cache.get(key) == 'schema'
+        assert key in cache
+        registry_ref = weakref.ref(registry)
+        del registries['db1'], registry, key
+        gc.collect()
+        assert registry_ref() is None
+
+    def test_release_closed_registry(self, registries):
+        cache = SchemaCache()
+        registry1 = self.add_registry(registries, 'db1')
+        registry2 = self.add_registry(registries, 'db2')
+        cache.set((registry1, 'Model.Test', False, (), None), 'schema1')
+        del registries['db1']
+        cache.set((registry2, 'Model.Test', False, (), None), 'schema2')
+        assert cache.cache_info().currsize == 1
+        assert cache.get((registry1, 'Model.Test', False, (), None)) is None
+
+    def test_release_garbage_collected_registry(self, registries):
+        cache = SchemaCache()
+        registry = FakeRegistry(None)
+        cache.set((registry, 'Model.Test', False, (), None), 'schema')
+        cache.release_closed_registries()
+        assert cache.cache_info().currsize == 1
+        del registry
+        gc.collect()
+        cache.release_closed_registries()
+        assert cache.cache_info().currsize == 0
+
+    def test_bounded_by_the_opened_registries(self, registries):
+        cache = SchemaCache()
+        for i in range(100):
+            registry = self.add_registry(registries, 'db')
+            for model in ('Model.Test1', 'Model.Test2'):
+                key = (registry, model, False, (), None)
+                assert cache.get(key) is None
+                cache.set(key, 'schema')
+
+            del registries['db']
+
+        assert cache.cache_info().currsize == 2
+
+
+class TestSchemaCacheReleaseRegistry:
+
+    def test_open_and_close_registries(self, bloks_loaded):
+        cache = SchemaCache()
+        ExempleSchema.schema_cache = cache
+        try:
+            for i in range(3):
+                registry = init_registry(add_simple_model)
+                try:
+                    ExempleSchema(registry=registry).schema
+                finally:
+                    registry.close()
+
+                assert cache.cache_info().currsize == 1
+
+            cache.release_closed_registries()
+            assert cache.cache_info().currsize == 0
+        finally:
+            delattr(ExempleSchema, 'schema_cache')
+
+
+shared_wrapper = SchemaWrapper(model='Model.Exemple')
+
+
+class TestSharedWrapperReleaseRegistry:
+
+    def test_registries_garbage_collected(self, bloks_loaded):
+        exemple = dict(id=1, name='test', number=2)
+        refs = []
+        for i in range(3):
+            registry = init_registry(add_simple_model)
+            try:
+                assert shared_wrapper.dump(
+                    exemple, registry=registry) == exemple
+            finally:
+                registry.close()
+
+            refs.append(weakref.ref(registry))
+            del registry
+
+        gc.collect()
+        # the last registry is still referenced by the anyblok's bloks
+        assert [x() for x in refs[:-1]] == [None, None]
+        shared_wrapper.release_closed_registries()
+        SchemaWrapper.schema_cache.release_closed_registries()
+        assert shared_wrapper.schemas == {}
+        assert not [
+            x for x in SchemaWrapper.schema_cache.data
+            if x[0]() is refs[-1]()
+        ]
+
+    def test_classes_not_changed_by_the_release(self, registry_simple_model):
+        registry = registry_simple_model
+        schema = ExempleSchema(registry=registry).schema
+        registries = RegistryManager.registries
+        db_name = registry.db_name
+        del registries[db_name]
+        try:
+            # the registry is unknown, as if it was closed by another thread
+            SchemaWrapper.schema_cache.release_closed_registries()
+        finally:
+            registries[db_name] = registry
+
+        assert schema.opts.model is registry.Exemple
+        assert schema.opts.sqla_session is registry.Session
+        assert schema.load({'name': 'test'}) == {'name': 'test'}
+
+
+class AddressModelSchema(SchemaWrapper):
+    model = 'Model.Address'
+
+
+class CustomerModelSchema(SchemaWrapper):
+    model = 'Model.Customer'
+
+
+class TestRemoteWrapper:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_complexe_model):
+        transaction = registry_complexe_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def count_primary_keys(self, monkeypatch, registry_complexe_model):
+        counter = {'calls': 0}
+        Customer = registry_complexe_model.Customer
+        get_primary_keys = Customer.get_primary_keys
+
+        def wrapper(cls):
+            counter['calls'] += 1
+            return get_primary_keys()
+
+        monkeypatch.setattr(Customer, 'get_primary_keys', classmethod(wrapper))
+        return counter
+
+    def get_wrapper(self, registry, Wrapper):
+        wrapper = Wrapper(registry=registry)
+        wrapper.schema_cache = SchemaCache()
+        return wrapper
+
+    def get_schema(self, registry, Wrapper):
+        return self.get_wrapper(registry, Wrapper).schema
+
+    def test_shared_wrapper_class(self, registry_complexe_model):
+        registry = registry_complexe_model
+        schema1 = self.get_schema(registry, AddressModelSchema)
+        schema2 = self.get_schema(registry, AddressModelSchema)
+        schema3 = self.get_schema(registry, CustomerModelSchema)
+        assert schema1.__class__ is not schema2.__class__
+        customer1 = schema1.fields['customer']
+        customer2 = schema2.fields['customer']
+        assert customer1.nested is customer2.nested
+        assert customer1.only == customer2.only == ('id',)
+        wrapper, pks = get_remote_wrapper(registry, 'Model.Customer')
+        assert customer1.nested is wrapper
+        assert pks == ('id',)
+        assert schema3.fields['addresses'].nested is get_remote_wrapper(
+            registry, 'Model.Address')[0]
+
+    def test_primary_keys_computed_once(
+        self, registry_complexe_model, count_primary_keys
+    ):
+        registry = registry_complexe_model
+        self.get_schema(registry, AddressModelSchema)
+        calls = count_primary_keys['calls']
+        for i in range(3):
+            self.get_schema(registry, AddressModelSchema)
+
+        assert count_primary_keys['calls'] == calls
+
+    def test_dump_with_shared_wrapper(self, registry_complexe_model):
+        registry = registry_complexe_model
+        city = registry.City.insert(name="Rouen", zipcode="76000")
+        customer = registry.Customer.insert(name="C1")
+        address = registry.Address.insert(
+            customer=customer, city=city, street="Street")
+        for i in range(2):
+            schema = self.get_wrapper(registry, AddressModelSchema)
+            assert schema.dump(address) == {
+                'id': address.id,
+                'street': 'Street',
+                'city': {'id': city.id},
+                'customer': {'id': customer.id},
+            }
+
+
+class TestBaseFields:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_simple_model):
+        transaction = registry_simple_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def count_conversions(self, monkeypatch):
+        counter = {'calls': 0}
+        property2field = ModelConverter.property2field
+
+        def wrapper(self, *args, **kwargs):
+            counter['calls'] += 1
+            return property2field(self, *args, **kwargs)
+
+        monkeypatch.setattr(ModelConverter, 'property2field', wrapper)
+        return counter
+
+    def get_schema(self, registry, **kwargs):
+        wrapper = ExempleSchema(registry=registry, **kwargs)
+        wrapper.schema_cache = SchemaCache()
+        return wrapper.schema
+
+    def test_model_converted_once(
+        self, registry_simple_model, count_conversions
+    ):
+        registry = registry_simple_model
+        self.get_schema(registry)
+        calls = count_conversions['calls']
+        self.get_schema(registry)
+        self.get_schema(registry, required_fields=True)
+        self.get_schema(registry, required_fields=['name'])
+        assert count_conversions['calls'] == calls
+
+    def test_required_fields_on_copies(self, registry_simple_model):
+        registry = registry_simple_model
+        schema1 = self.get_schema(registry)
+        schema2 = self.get_schema(registry, required_fields=True)
+        schema3 = self.get_schema(registry, required_fields=['number'])
+        assert schema1.fields['number'].required is False
+        assert schema1.fields['number'].allow_none is True
+        assert schema2.fields['number'].required is True
+        assert schema2.fields['number'].allow_none is False
+        assert schema3.fields['number'].required is True
+        assert schema3.fields['id'].required is False
+        assert schema1.fields['number'] is not schema2.fields['number']
+        with pytest.raises(ValidationError):
+            schema2.load({'name': 'test'})
+
+        schema1.load({'name': 'test'})
+
+    @pytest.fixture
+    def conversions(self, monkeypatch):
+        monkeypatch.setattr(
+            schema_module, 'base_fields_tables', weakref.WeakKeyDictionary())
+        conversions = {'calls': [], 'barrier': None}
+        convert_model = ModelConverter.convert_model
+
+        def wrapper(self, Model, **kwargs):
+            conversions['calls'].append(kwargs)
+            if conversions['barrier'] is not None:
+                conversions['barrier'].wait()
+            else:
+                time.sleep(0.05)
+
+            return convert_model(self, Model, **kwargs)
+
+        monkeypatch.setattr(ModelConverter, 'convert_model', wrapper)
+        return conversions
+
+    def convert_in_threads(self, Model, options):
+        tables = []
+
+        def convert(kwargs):
+            tables.append(ModelConverter().get_base_fields(Model, **kwargs))
+
+        threads = [
+            threading.Thread(target=convert, args=(x,)) for x in options]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return tables
+
+    def test_different_keys_converted_at_the_same_time(
+        self, registry_simple_model, conversions
+    ):
+        # each conversion waits for the other one
+        conversions['barrier'] = threading.Barrier(2, timeout=5)
+        tables = self.convert_in_threads(
+            registry_simple_model.Exemple,
+            [{'include_fk': False}, {'include_fk': True}])
+        assert len(conversions['calls']) == 2
+        assert len(tables) == 2
+
+    def test_same_key_converted_once(
+        self, registry_simple_model, conversions
+    ):
+        tables = self.convert_in_threads(
+            registry_simple_model.Exemple, [{}, {}, {}])
+        assert len(conversions['calls']) == 1
+        assert tables[0] is tables[1] is tables[2]
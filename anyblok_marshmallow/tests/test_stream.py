@@ -0,0 +1,115 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import io
+import json
+import pytest
+from marshmallow.exceptions import ValidationError
+from anyblok_marshmallow import SchemaWrapper, PostLoadSchema
+
+
+class CityBatchSchema(SchemaWrapper):
+    model = 'Model.City'
+
+    class Schema(PostLoadSchema):
+        post_load_batch_size = 100
+
+
+class TestLoadsIter:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_complexe_model):
+        transaction = registry_complexe_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    @pytest.fixture
+    def count_queries(self, registry_complexe_model, capture_statements):
+        return capture_statements(registry_complexe_model, startswith='SELECT')
+
+    def add_cities(self, registry, nb):
+        return [registry.City.insert(name="City %d" % i, zipcode="76000")
+                for i in range(nb)]
+
+    def get_lines(self, cities):
+        return io.StringIO(''.join(
+            json.dumps(self.get_data(x)) + '\n' for x in cities))
+
+    def get_data(self, city):
+        return {'id': city.id, 'name': city.name, 'zipcode': city.zipcode}
+
+    def test_loads_iter(self, registry_complexe_model):
+        registry = registry_complexe_model
+        cities = self.add_cities(registry, 5)
+        schema = CityBatchSchema(registry=registry)
+        res = list(schema.loads_iter(self.get_lines(cities), batch_size=2))
+        assert res == [(i + 1, x) for i, x in enumerate(cities)]
+
+    def test_loads_iter_by_batch(
+        self, registry_complexe_model, count_queries
+    ):
+        registry = registry_complexe_model
+        cities = self.add_cities(registry, 10)
+        schema = CityBatchSchema(registry=registry)
+        schema.schema
+        registry.flush()
+        del count_queries[:]
+        res = list(schema.loads_iter(self.get_lines(cities), batch_size=4))
+        assert len(res) == 10
+        assert len(count_queries) == 3
+
+    def test_loads_iter_is_lazy(self, registry_complexe_model):
+        registry = registry_complexe_model
+        cities = self.add_cities(registry, 10)
+        lines = self.get_lines(cities)
+        read = []
+
+        def read_lines():
+            for line in lines:
+                read.append(line)
+                yield line
+
+        schema = CityBatchSchema(registry=registry)
+        iterator = schema.loads_iter(read_lines(), batch_size=3)
+        assert not read
+        assert next(iterator) == (1, cities[0])
+        assert len(read) == 3
+
+    def test_loads_iter_with_errors(self, registry_complexe_model):
+        registry = registry_complexe_model
+        cities = self.add_cities(registry, 3)
+        lines = io.StringIO('\n'.join([
+            json.dumps(self.get_data(cities[0])),
+            '{"id": ',
+            json.dumps(dict(self.get_data(cities[0]), id='wrong')),
+            '',
+            json.dumps(self.get_data(cities[1])),
+            json.dumps(dict(self.get_data(cities[0]), id=0)),
+            json.dumps(self.get_data(cities[2])),
+        ]))
+        schema = CityBatchSchema(registry=registry)
+        res = list(schema.loads_iter(lines, batch_size=10))
+        assert [x[0] for x in res] == [1, 2, 3, 5, 6, 7]
+        assert res[0][1] is cities[0]
+        assert res[3][1] is cities[1]
+        assert res[5][1] is cities[2]
+        for index, key in ((1, '_schema'), (2, 'id'), (4, 'instance')):
+            error = res[index][1]
+            assert isinstance(error, ValidationError)
+            assert key in error.messages
+
+    def test_loads_iter_schema_error(self, registry_complexe_model):
+        registry = registry_complexe_model
+        cities = self.add_cities(registry, 2)
+        lines = io.StringIO('\n'.join([
+            json.dumps(self.get_data(cities[0])),
+            json.dumps([cities[1].id]),
+        ]))
+        schema = CityBatchSchema(registry=registry)
+        res = list(schema.loads_iter(lines))
+        assert res[0] == (1, cities[0])
+        assert res[1][0] == 2
+        assert isinstance(res[1][1], ValidationError)
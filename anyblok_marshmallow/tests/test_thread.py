@@ -0,0 +1,149 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import asyncio
+import pytest
+from threading import Thread, Barrier
+from anyblok_marshmallow import SchemaWrapper
+
+
+class TestThreadSafe:
+
+    nb_threads = 8
+    nb_calls = 200
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_simple_model):
+        transaction = registry_simple_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    def run_threads(self, target):
+        barrier = Barrier(self.nb_threads)
+        errors = []
+
+        def run(index):
+            barrier.wait()
+            try:
+                for i in range(self.nb_calls):
+                    target(index)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=run, args=(index,))
+                   for index in range(self.nb_threads)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert not errors
+
+    def test_call_options_do_not_change_the_wrapper(
+        self, registry_simple_model
+    ):
+        wrapper = SchemaWrapper()
+        data = wrapper.dump(
+            dict(id=1, name='test', number=2),
+            registry=registry_simple_model, model='Model.Exemple',
+            only_primary_key=True)
+        assert data == {'id': 1}
+        assert wrapper.registry is None
+        assert wrapper.model is None
+        assert wrapper.only_primary_key is None
+
+    def test_validate_from_many_threads(self, registry_simple_model):
+        wrapper = SchemaWrapper(
+            registry=registry_simple_model, model='Model.Exemple')
+        wrapper.schema
+
+        def target(index):
+            if index % 2:
+                errors = wrapper.validate(
+                    dict(name='test'), required_fields=['number'])
+                assert list(errors) == ['number']
+            else:
+                assert wrapper.validate(dict(name='test')) == {}
+
+        self.run_threads(target)
+
+    def test_dump_from_many_threads(self, registry_simple_model):
+        wrapper = SchemaWrapper(registry=registry_simple_model)
+        exemple = dict(id=1, name='test', number=2)
+
+        def target(index):
+            if index % 2:
+                data = wrapper.dump(
+                    exemple, model='Model.Exemple', only_primary_key=True)
+                assert data == {'id': 1}
+            else:
+                data = wrapper.dump(exemple, model='Model.Exemple')
+                assert data == exemple
+
+        wrapper.dump(exemple, model='Model.Exemple')
+        self.run_threads(target)
+
+    def test_schemas_by_thread(self, registry_simple_model):
+        wrapper = SchemaWrapper(
+            registry=registry_simple_model, model='Model.Exemple')
+        schemas = []
+
+        def target(index):
+            schemas.append(wrapper.schema)
+
+        thread = Thread(target=target, args=(0,))
+        thread.start()
+        thread.join()
+        target(1)
+        assert schemas[0] is not schemas[1]
+        assert schemas[0].__class__ is schemas[1].__class__
+
+    def test_interleaved_asyncio_tasks(self, registry_simple_model):
+        wrapper = SchemaWrapper(registry=registry_simple_model)
+        exemple = dict(id=1, name='test', number=2)
+
+        async def task(index):
+            for i in range(self.nb_calls):
+                if index % 2:
+                    data = wrapper.dump(
+                        exemple, model='Model.Exemple', only_primary_key=True)
+                    assert data == {'id': 1}
+                    errors = wrapper.validate(
+                        dict(name='test'), model='Model.Exemple',
+                        required_fields=['number'])
+                    assert list(errors) == ['number']
+                else:
+                    data = wrapper.dump(exemple, model='Model.Exemple')
+                    assert data == exemple
+                    assert wrapper.validate(
+                        dict(name='test'), model='Model.Exemple') == {}
+
+                await asyncio.sleep(0)
+
+        async def iter_task(index):
+            res = []
+            for data in wrapper.dump_iter(
+                [exemple] * 10, model='Model.Exemple',
+                only_primary_key=bool(index % 2)
+            ):
+                res.append(data)
+                await asyncio.sleep(0)
+
+            return res
+
+        async def run():
+            await asyncio.gather(*[task(x) for x in range(self.nb_threads)])
+            return await asyncio.gather(iter_task(0), iter_task(1))
+
+        loop = asyncio.new_event_loop()
+        try:
+            full, pks = loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+        assert full == [exemple] * 10
+        assert pks == [{'id': 1}] * 10
@@ -0,0 +1,72 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import pytest
+from copy import deepcopy
+from marshmallow import Schema, fields, validate
+from marshmallow.exceptions import ValidationError
+from anyblok_marshmallow.validate import OneOf
+
+
+class TestOneOf:
+
+    def test_valid_choice(self):
+        validator = OneOf(['foo', 'bar'], labels=['Foo', 'Bar'])
+        assert validator('foo') == 'foo'
+        assert validator.choices_set == frozenset(('foo', 'bar'))
+
+    def test_invalid_choice(self):
+        validator = OneOf(['foo', 'bar'])
+        with pytest.raises(ValidationError) as exception:
+            validator('baz')
+
+        assert exception.value.messages == ['Must be one of: foo, bar.']
+
+    def test_same_error_as_marshmallow(self):
+        error = "{input} not in {choices} ({labels})"
+        validator = OneOf(['foo', 'bar'], labels=['Foo', 'Bar'], error=error)
+        origin = validate.OneOf(['foo', 'bar'], labels=['Foo', 'Bar'],
+                                error=error)
+        for validator_ in (validator, origin):
+            with pytest.raises(ValidationError) as exception:
+                validator_('baz')
+
+            assert exception.value.messages == [
+                'baz not in foo, bar (Foo, Bar)']
+
+    def test_unhashable_value(self):
+        validator = OneOf(['foo', 'bar'])
+        with pytest.raises(ValidationError):
+            validator(['foo'])
+
+    def test_unhashable_choices(self):
+        validator = OneOf([['foo'], ['bar']])
+        assert validator.choices_set is None
+        assert validator(['foo']) == ['foo']
+        with pytest.raises(ValidationError):
+            validator(['baz'])
+
+    def test_texts_are_built_on_error(self):
+        validator = OneOf(['foo', 'bar'], labels=['Foo', 'Bar'])
+        validator('foo')
+        assert validator._choices_text is None
+        assert validator._labels_text is None
+        assert validator.choices_text == 'foo, bar'
+        assert validator.labels_text == 'Foo, Bar'
+
+    def test_options(self):
+        validator = OneOf(['foo', 'bar'], labels=['Foo', 'Bar'])
+        assert list(validator.options()) == [('foo', 'Foo'), ('bar', 'Bar')]
+
+    def test_shared_by_the_schema_instances(self):
+        validator = OneOf(['foo', 'bar'])
+        assert deepcopy(validator) is validator
+
+        class MySchema(Schema):
+            name = fields.String(validate=validator)
+
+        assert MySchema().fields['name'].validators[0] is validator
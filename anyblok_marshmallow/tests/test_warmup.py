@@ -0,0 +1,108 @@
+# This file is a part of the AnyBlok / Marshmallow project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import pytest
+from . import (
+    CustomerSchema, AddressSchema, CitySchema, TagSchema, ExempleSchema
+)
+from anyblok_marshmallow import SchemaWrapper, schema_cache, warm_up
+from anyblok_marshmallow.fields import Country
+from anyblok_marshmallow.warmup import get_wrapper_classes
+
+
+class UnknownSchema(SchemaWrapper):
+    model = 'Model.Unknown'
+
+
+class TestWarmUp:
+
+    @pytest.fixture(autouse=True)
+    def transact(self, request, registry_complexe_model):
+        transaction = registry_complexe_model.begin_nested()
+        request.addfinalizer(transaction.rollback)
+
+    def test_get_wrapper_classes(self):
+        wrappers = get_wrapper_classes()
+        for wrapper in (CustomerSchema, AddressSchema, CitySchema, TagSchema):
+            assert wrapper in wrappers
+
+        assert SchemaWrapper not in wrappers
+        assert not [x for x in wrappers if x.model is None]
+
+    def test_warm_up(self, registry_complexe_model):
+        registry = registry_complexe_model
+        schema_cache.invalidate(registry)
+        reports = warm_up(registry)
+        wrappers = [x.wrapper for x in reports]
+        for wrapper in (CustomerSchema, AddressSchema, CitySchema, TagSchema):
+            assert wrapper in wrappers
+
+        assert ExempleSchema not in wrappers
+        assert UnknownSchema not in wrappers
+        assert all(x.error is None for x in reports)
+        assert all(x.duration >= 0 for x in reports)
+        assert {x.model for x in reports} >= {
+            'Model.Customer', 'Model.Address', 'Model.City', 'Model.Tag'}
+
+    def test_no_generation_after_warm_up(self, registry_complexe_model):
+        registry = registry_complexe_model
+        schema_cache.invalidate(registry)
+        warm_up(registry, wrappers=[CustomerSchema])
+        misses = schema_cache.cache_info().misses
+        customer = registry.Customer.insert(name="test")
+        CustomerSchema(registry=registry).dump(customer)
+        assert schema_cache.cache_info().misses == misses
+
+    def test_no_generation_of_deep_nested_after_warm_up(
+        self, registry_complexe_model, monkeypatch
+    ):
+        registry = registry_complexe_model
+        schema_cache.invalidate(registry)
+        warm_up(registry, wrappers=[CustomerSchema])
+        builds = []
+        build_marsmallow_class = SchemaWrapper.build_marsmallow_class
+
+        def wrapper(self, *args, **kwargs):
+            builds.append(args)
+            return build_marsmallow_class(self, *args, **kwargs)
+
+        monkeypatch.setattr(SchemaWrapper, 'build_marsmallow_class', wrapper)
+        city = registry.City.insert(name="Rouen", zipcode="76000")
+        customer = registry.Customer.insert(name="test")
+        registry.Address.insert(customer=customer, city=city, street="Street")
+        data = CustomerSchema(registry=registry).dump(customer)
+        assert data['addresses'][0]['city']['name'] == 'Rouen'
+        assert not builds
+
+    def test_warm_up_error(self, registry_complexe_model):
+        registry = registry_complexe_model
+        reports = warm_up(registry, wrappers=[UnknownSchema, CitySchema])
+        assert reports[0].wrapper is UnknownSchema
+        assert reports[0].error is not None
+        assert reports[1].wrapper is CitySchema
+        assert reports[1].error is None
+
+    def test_warm_up_shared_wrapper(self, registry_complexe_model):
+        registry = registry_complexe_model
+        customer_schema = CustomerSchema(compiled_dump=True)
+        reports = warm_up(registry, wrappers=[customer_schema])
+        assert reports[0].wrapper is customer_schema
+        assert reports[0].model == 'Model.Customer'
+        assert reports[0].error is None
+        schemas = dict(customer_schema.schemas)
+        assert len(schemas) == 1
+        schema = list(schemas.values())[0]
+        assert schema._compiled_dump is not None
+        customer = registry.Customer.insert(name="test")
+        customer_schema.dump(customer, registry=registry)
+        assert customer_schema.schemas == schemas
+
+    def test_warm_up_countries(self, registry_complexe_model, monkeypatch):
+        pytest.importorskip('pycountry')
+        monkeypatch.setattr(Country, 'tables', None)
+        warm_up(registry_complexe_model, wrappers=[])
+        assert Country.tables is not None
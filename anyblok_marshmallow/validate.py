@@ -0,0 +1,112 @@
+# This file is a part of the AnyBlok / Marshmallow api project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from marshmallow import validate
+from marshmallow.exceptions import ValidationError
+from .cache import LRUCache
+
+
+class OneOf(validate.OneOf):
+    """Same validator as ``marshmallow.validate.OneOf`` with a hashed
+    membership
+
+    The choices are kept in a frozenset, the texts of the error message
+    are only built when the first error is raised. If one of the choices
+    is not hashable, the validator falls back on the linear search of
+    marshmallow
+
+    ::
+
+        validator = OneOf(('foo', 'bar'), labels=('Foo', 'Bar'))
+        validator('foo')  # 'foo'
+        validator('baz')  # raise ValidationError
+    """
+
+    def __init__(self, choices, labels=None, *, error=None):
+        self.choices = tuple(choices)
+        self.labels = tuple(labels) if labels is not None else ()
+        self.error = error or self.default_message
+        self._choices_text = None
+        self._labels_text = None
+        try:
+            self.choices_set = frozenset(self.choices)
+        except TypeError:
+            self.choices_set = None
+
+    def __deepcopy__(self, memo):
+        # the validator is not changed after its creation, the copies of
+        # the declared fields of each schema instance share it
+        return self
+
+    @property
+    def choices_text(self):
+        if self._choices_text is None:
+            self._choices_text = ", ".join(str(x) for x in self.choices)
+
+        return self._choices_text
+
+    @property
+    def labels_text(self):
+        if self._labels_text is None:
+            self._labels_text = ", ".join(str(x) for x in self.labels)
+
+        return self._labels_text
+
+    def __call__(self, value):
+        if self.choices_set is None:
+            return super(OneOf, self).__call__(value)
+
+        try:
+            if value not in self.choices_set:
+                raise ValidationError(self._format_error(value))
+        except TypeError as error:
+            raise ValidationError(self._format_error(value)) from error
+
+        return value
+
+
+selection_validators = LRUCache(maxsize=1024)
+country_validator = None
+
+
+def get_selection_validator(Model, field, selections):
+    """Return the ``OneOf`` validator of a Selection column
+
+    The validator is shared by all the schemas generated for the column.
+    AnyBlok caches the description of the fields by model, so the
+    validator is built again only when the selections are not the same
+    object, after a reload of the registry
+
+    :param Model: AnyBlok model
+    :param field: name of the Selection column
+    :param selections: list of (key, label) from ``fields_description``
+    """
+    key = (Model.__registry_name__, field)
+    entry = selection_validators.get(key)
+    if entry is not None and entry[0] is selections:
+        return entry[1]
+
+    choices = dict(selections)
+    validator = OneOf(choices.keys(), labels=choices.values())
+    selection_validators.set(key, (selections, validator))
+    return validator
+
+
+def get_country_validator():
+    """Return the ``OneOf`` validator of the alpha_3 codes of pycountry
+
+    The table of the countries does not change, it is built once
+    """
+    global country_validator
+    if country_validator is None:
+        import pycountry
+        countries = list(pycountry.countries)
+        country_validator = OneOf(
+            [x.alpha_3 for x in countries],
+            labels=[x.name for x in countries])
+
+    return country_validator
@@ -0,0 +1,139 @@
+# This file is a part of the AnyBlok / Marshmallow api project
+#
+#    Copyright (C) 2019 Jean-Sebastien SUZANNE <js.suzanne@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from collections import namedtuple
+from time import perf_counter
+from marshmallow.fields import List, Nested
+from .fields import Country
+from .schema import DUMP_OPTIONS, SchemaWrapper
+from . import compiler
+
+
+WarmUpReport = namedtuple(
+    'WarmUpReport', ['wrapper', 'model', 'duration', 'error'])
+
+
+def get_wrapper_classes(cls=SchemaWrapper):
+    """Return the subclasses of the ``SchemaWrapper`` which define a model
+
+    The wrappers generated by the ``ModelConverter`` for the relationships
+    are ignored, they are built with the schema of their parent
+    """
+    res = []
+    for subclass in cls.__subclasses__():
+        if (
+            subclass.model is not None and
+            subclass.__module__ != SchemaWrapper.__module__
+        ):
+            res.append(subclass)
+
+        res.extend(get_wrapper_classes(subclass))
+
+    return list(dict.fromkeys(res))
+
+
+def get_real_schema(field):
+    """Return the real schema of the Nested field"""
+    schema = field.schema
+    if isinstance(schema, SchemaWrapper):
+        schema = schema.schema
+
+    return schema
+
+
+def build_nested_schemas(schema, visited):
+    """Generate the schemas of the Nested fields, and of their own Nested
+    fields, each schema class is visited once"""
+    for field in schema.fields.values():
+        if isinstance(field, List):
+            field = field.inner
+
+        if not isinstance(field, Nested):
+            continue
+
+        nested = get_real_schema(field)
+        if nested.__class__ in visited:
+            continue
+
+        visited.add(nested.__class__)
+        build_nested_schemas(nested, visited)
+
+
+def build_schema(wrapper, registry):
+    """Generate the schema of the wrapper and all its nested schemas
+
+    For a wrapper class, only the schema classes are saved, in the process
+    wide ``schema_cache``. For a wrapper instance, the schema instances
+    and the compiled dump function are also saved by the wrapper, for the
+    current thread
+    """
+    if not isinstance(wrapper, SchemaWrapper):
+        schema = wrapper(registry=registry).schema
+    else:
+        options = wrapper.get_options({'registry': registry}, DUMP_OPTIONS)
+        schema = wrapper.get_schema(options)
+        if options.compiled_dump:
+            compiler.get_dump_function(schema)
+
+    build_nested_schemas(schema, {schema.__class__})
+
+
+def warm_up_countries():
+    """Build the lookup tables of the ``Country`` field, if pycountry is
+    installed"""
+    try:
+        Country.warm_up()
+    except ImportError:
+        pass
+
+
+def warm_up(registry, wrappers=None):
+    """Generate the schemas of the wrappers for the registry
+
+    The first call of a wrapper generates the marshmallow schema class,
+    which is saved in the process wide ``schema_cache``. This function can
+    be called after the load of the registry, so the workers do not pay
+    this cost on their first requests::
+
+        registry = RegistryManager.get(db_name)
+        for report in warm_up(registry):
+            print(report.wrapper, report.duration)
+
+    The schema instances are saved by wrapper instance and by thread. To
+    also warm the wrappers shared by the requests, give the instances, and
+    call ``warm_up`` in each thread which uses them::
+
+        customer_schema = CustomerSchema()
+        warm_up(registry, wrappers=[customer_schema, AddressSchema])
+
+    The lookup tables of the ``Country`` field are built too. An error is
+    given in the report, it does not stop the warm up of the other wrappers
+
+    :param registry: the AnyBlok registry
+    :param wrappers: list of the ``SchemaWrapper`` classes or instances, by
+                     default all the subclasses which define a model of
+                     the registry
+    :rtype: list of ``WarmUpReport`` (wrapper, model, duration, error)
+    """
+    if wrappers is None:
+        wrappers = [
+            x for x in get_wrapper_classes() if registry.has(x.model)]
+
+    warm_up_countries()
+    reports = []
+    for wrapper in wrappers:
+        start = perf_counter()
+        error = None
+        try:
+            build_schema(wrapper, registry)
+        except Exception as e:
+            error = e
+
+        reports.append(WarmUpReport(
+            wrapper, wrapper.model, perf_counter() - start, error))
+
+    return reports